@@ -0,0 +1,626 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks for the hot paths of recur.py and the todo script.
+
+Run with `python bench.py [benchmark ...]`, results are printed as one line per
+measurement. With --json the results are written as a JSON list of records
+instead, and --compare checks them against such a file to catch regressions.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+import threading
+import subprocess
+
+import recur
+import todolist
+import todoserver
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+SIZES = [1000, 10000, 100000]
+TODO_ACTIONS = ['ls', 'context', 'date', 'nodate', 'past', 'future', 'today']
+CONTEXTS = [':home:', ':work:', ':email:', ':coding:', ':docs:', ':errands:']
+WORDS = 'call buy fix write review plan clean read send update book check'.split()
+WEEKDAY_NAMES = ['Mon', 'Tue', 'Wednesday', 'th', 'Fri', 'Sat', 'Sun']
+NTH_NAMES = ['1st', '2nd', '3rd', '4th', '5th', 'last']
+MONTH_NAMES = ['Jan', 'Feb', 'March', 'Apr', 'May', 'Jun', 'July', 'Aug', 'Sep', 'Dec']
+
+
+def make_todo_file(path, num_lines):
+    """Write a synthetic todo file with the given number of task lines."""
+    with open(path, 'w') as fd:
+        for i in range(num_lines):
+            fd.write(f'- [ ] synthetic task number {i} :bench: t:2021-11-29\n')
+
+
+def generate_todo_file(path, num_lines, seed=0, today=None):
+    """Write a realistic todo file of about num_lines lines.
+
+    Tasks are checked or unchecked, have contexts and t: dates around today
+    and nested subtasks, with headings and notes in between.
+    """
+
+    rng = random.Random(seed)
+    today = today or datetime.date.today()
+    lines = 0
+    with open(path, 'w') as fd:
+        while lines < num_lines:
+            if rng.random() < 0.02:
+                heading = f'# Notes on {rng.choice(WORDS)} {rng.choice(CONTEXTS)}'
+                fd.write(f'\n{heading}\n\n')
+                lines += 3
+                continue
+            depth = 0 if rng.random() < 0.7 else rng.randint(1, 3)
+            status = 'X' if rng.random() < 0.2 else ' '
+            words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 6)))
+            task = f'{"    " * depth}- [{status}] {words} {lines}'
+            if rng.random() < 0.5:
+                task += ' ' + ' '.join(rng.sample(CONTEXTS, rng.randint(1, 2)))
+            if rng.random() < 0.6:
+                date = today + datetime.timedelta(days=rng.randint(-60, 60))
+                task += f' t:{date:%F}'
+            fd.write(task + '\n')
+            lines += 1
+
+
+def generate_recur_file(path, num_rules, seed=0):
+    """Write a recur.txt cycling through every reminder pattern parse_rem supports."""
+
+    rng = random.Random(seed)
+    month_day = lambda: f'{rng.choice(MONTH_NAMES)} {rng.randint(1, 28)}'
+    patterns = [
+        lambda: f'{rng.randint(1, 31)}',
+        lambda: ' '.join(str(day) for day in sorted(rng.sample(range(1, 29), 3))),
+        lambda: rng.choice(WEEKDAY_NAMES),
+        lambda: ' '.join(rng.sample(WEEKDAY_NAMES, 3)),
+        month_day,
+        lambda: f'{month_day()} {rng.randint(2000, 2030)}',
+        lambda: f'{month_day()} +{rng.randint(1, 10)}',
+        lambda: f'{month_day()} *{rng.randint(1, 10)}',
+        lambda: f'{month_day()} {rng.randint(2000, 2030)} +{rng.randint(1, 10)}',
+        lambda: '-'.join(rng.sample(WEEKDAY_NAMES, 2)),
+        lambda: f'{rng.choice(NTH_NAMES)} {rng.choice(WEEKDAY_NAMES)}',
+        lambda: 'last',
+        lambda: f'every {rng.randint(1, 4)} weeks from 2026-{rng.randint(1, 12):02}-01',
+    ]
+    with open(path, 'w') as fd:
+        for i in range(num_rules):
+            pattern = patterns[i % len(patterns)]()
+            fd.write(f'{{{pattern}}} recurring task {i} {rng.choice(CONTEXTS)}\n')
+
+
+def timed(func, *args, repeat=1, setup=None):
+    """Get the shortest wall time of calling func, after calling setup each time."""
+
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func(*args)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def bench_add_tasks(todo_dir, sizes, num_lines=100000, num_tasks=100):
+    """Compare prepending tasks one by one against a single batched write."""
+
+    tasks = [(f'recurring task {i}', '2022-01-01') for i in range(num_tasks)]
+
+    def add_one_by_one():
+        for task, date_str in tasks:
+            recur.add_task(task, date_str)
+
+    setup = lambda: make_todo_file(recur.TODO_FILE, num_lines)
+    params = {'lines': num_lines, 'tasks': num_tasks}
+    return [
+        {'mode': 'single', **params, 'seconds': timed(add_one_by_one, setup=setup)},
+        {
+            'mode': 'batched',
+            **params,
+            'seconds': timed(recur.add_tasks, tasks, setup=setup),
+        },
+    ]
+
+
+def make_archive_file(path, num_tasks):
+    """Write a synthetic todo file where every third task is done and has a subtask."""
+    with open(path, 'w') as fd:
+        for i in range(num_tasks):
+            fd.write(f'- [{"X" if i % 3 == 0 else " "}] synthetic task number {i}\n')
+            if i % 3 == 0:
+                fd.write(f'    - [ ] subtask of task {i}\n\n')
+
+
+def bench_archive(todo_dir, sizes, num_tasks=100000):
+    """Compare the streaming archive against the grep/diff pipeline of the todo script."""
+
+    done_file = os.path.join(todo_dir, 'done.md')
+    setup = lambda: make_archive_file(recur.TODO_FILE, num_tasks)
+    results = [
+        {
+            'mode': 'streaming',
+            'tasks': num_tasks,
+            'seconds': timed(
+                todolist.archive, recur.TODO_FILE, done_file, setup=setup
+            ),
+        }
+    ]
+
+    if shutil.which('bash'):
+        os.remove(done_file)
+        shutil.copy(os.path.join(BASE_DIR, 'todo'), todo_dir)
+        env = {**os.environ, 'TODOTXT_DISABLE_ENGINE': '1'}
+        results.append(
+            {
+                'mode': 'shell',
+                'tasks': num_tasks,
+                'seconds': timed(run_todo, todo_dir, 'archive', env, setup=setup),
+            }
+        )
+    return results
+
+
+def run_todo(todo_dir, action, env=None):
+    """Run an action of the todo script installed in todo_dir."""
+    subprocess.run(
+        ['bash', os.path.join(todo_dir, 'todo'), action],
+        cwd=todo_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+
+
+def bench_workspace(todo_dir, sizes, num_pages=2000, num_lines=200):
+    """Compare parsing a workspace in this process against the process pool."""
+
+    workspace_dir = os.path.join(todo_dir, 'wiki')
+    for i in range(num_pages):
+        page_dir = os.path.join(workspace_dir, f'project{i % 20}')
+        os.makedirs(page_dir, exist_ok=True)
+        make_todo_file(os.path.join(page_dir, f'page{i}.md'), num_lines)
+
+    params = {'pages': num_pages, 'lines': num_lines, 'cores': os.cpu_count()}
+    results = [
+        {
+            'mode': 'serial',
+            **params,
+            'seconds': timed(todolist.parse_workspace, workspace_dir, (), 1),
+        },
+        {
+            'mode': 'pool',
+            **params,
+            'seconds': timed(todolist.parse_workspace, workspace_dir),
+        },
+    ]
+    shutil.rmtree(workspace_dir)
+    return results
+
+
+def bench_daemon(todo_dir, sizes, num_lines=100000, num_queries=1000):
+    """Compare listing queries answered by the daemon against parsing the todo file."""
+
+    make_todo_file(recur.TODO_FILE, num_lines)
+    terms = ['number 4242']
+
+    def direct():
+        todolist.list_items(todolist.parse(recur.TODO_FILE), terms)
+
+    def daemon():
+        for _ in range(num_queries):
+            todolist.query_daemon(recur.TODO_FILE, 'ls', terms)
+
+    results = [{'mode': 'direct', 'lines': num_lines, 'seconds': timed(direct)}]
+    server = todoserver.TodoServer(recur.TODO_FILE)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        todolist.query_daemon(recur.TODO_FILE, 'ls', terms)
+        results.append(
+            {
+                'mode': 'daemon',
+                'lines': num_lines,
+                'seconds': timed(daemon) / num_queries,
+            }
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        os.unlink(todolist.get_sidecar_file(recur.TODO_FILE, 'sock'))
+    return results
+
+
+def bench_todo_actions(todo_dir, sizes):
+    """Time each listing action and archive on realistic todo files.
+
+    The listing actions are timed in this process with a cold and a warm index,
+    and end to end through the todo script when bash is available.
+    """
+
+    index_file = todolist.get_sidecar_file(recur.TODO_FILE, 'idx')
+    done_file = os.path.join(todo_dir, 'done.md')
+    has_bash = shutil.which('bash') is not None
+    if has_bash:
+        for name in ('todo', 'todolist.py', 'todoserver.py', 'todosearch.py'):
+            shutil.copy(os.path.join(BASE_DIR, name), todo_dir)
+
+    def drop_index():
+        if os.path.exists(index_file):
+            os.remove(index_file)
+
+    results = []
+    for size in sizes:
+        generate_todo_file(recur.TODO_FILE, size)
+        for action in TODO_ACTIONS:
+            run = lambda: todolist.run(action, [], recur.TODO_FILE)
+            for mode, setup in (('cold', drop_index), ('warm', None)):
+                results.append(
+                    {
+                        'action': action,
+                        'mode': mode,
+                        'lines': size,
+                        'seconds': timed(run, repeat=3, setup=setup),
+                    }
+                )
+            if has_bash:
+                results.append(
+                    {
+                        'action': action,
+                        'mode': 'script',
+                        'lines': size,
+                        'seconds': timed(run_todo, todo_dir, action, repeat=3),
+                    }
+                )
+
+        setup = lambda: generate_todo_file(recur.TODO_FILE, size)
+        results.append(
+            {
+                'action': 'archive',
+                'mode': 'cold',
+                'lines': size,
+                'seconds': timed(
+                    todolist.archive, recur.TODO_FILE, done_file, setup=setup
+                ),
+            }
+        )
+    return results
+
+
+def bench_startup(todo_dir, sizes):
+    """Time a listing call of todolist.py against starting the interpreter alone.
+
+    todolist.py is started on every call of the todo script, the difference is
+    what importing it and listing a todo file add to each call.
+    """
+
+    env = {**os.environ, 'TODO_FILE': recur.TODO_FILE}
+    script = os.path.join(BASE_DIR, 'todolist.py')
+    run = lambda *args: subprocess.run(
+        [sys.executable, *args], env=env, stdout=subprocess.DEVNULL, check=True
+    )
+
+    results = [{'mode': 'interpreter', 'seconds': timed(run, '-c', 'pass', repeat=5)}]
+    for size in sizes:
+        generate_todo_file(recur.TODO_FILE, size)
+        results.append(
+            {
+                'mode': 'ls',
+                'lines': size,
+                'seconds': timed(run, script, 'ls', repeat=5),
+            }
+        )
+    return results
+
+
+def bench_recur(todo_dir, sizes, num_rules=1000):
+    """Time get_tasks and add_today_tasks on realistic todo and recur files.
+
+    get_tasks scans the todo file on every call and keeps no state between
+    them. add_today_tasks is timed with and without the rules cache, each run
+    starts from the same todo file and without a last run date.
+    """
+
+    cache_file = recur.get_rules_cache_file(recur.RECUR_FILE)
+    generate_recur_file(recur.RECUR_FILE, num_rules)
+    today = f'{datetime.date.today():%F}'
+
+    results = []
+    for size in sizes:
+        generate_todo_file(recur.TODO_FILE, size)
+        with open(recur.TODO_FILE) as fd:
+            content = fd.read()
+
+        def reset(*paths):
+            with open(recur.TODO_FILE, 'w') as fd:
+                fd.write(content)
+            for path in (recur.LAST_RUN_FILE, *paths):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        params = {'lines': size, 'rules': num_rules}
+        results += [
+            {
+                'function': 'get_tasks',
+                **params,
+                'seconds': timed(recur.get_tasks, today, repeat=3),
+            },
+            {
+                'function': 'add_today_tasks',
+                'mode': 'cold',
+                **params,
+                'seconds': timed(
+                    recur.add_today_tasks,
+                    recur.RECUR_FILE,
+                    repeat=3,
+                    setup=lambda: reset(cache_file),
+                ),
+            },
+            {
+                'function': 'add_today_tasks',
+                'mode': 'warm',
+                **params,
+                'seconds': timed(
+                    recur.add_today_tasks, recur.RECUR_FILE, repeat=3, setup=reset
+                ),
+            },
+        ]
+    return results
+
+
+def bench_rules(todo_dir, sizes, num_rules=50000):
+    """Compare finding the rules of a day by checking each rule against the rule index.
+
+    Compiling and indexing the rules is timed apart, it happens once per config
+    change and the result is cached.
+    """
+
+    recur_file = os.path.join(todo_dir, 'rules.txt')
+    generate_recur_file(recur_file, num_rules)
+    rules = recur.compile_rules(recur.get_dict(recur_file))
+    index = recur.index_rules(rules)
+    date = datetime.date.today()
+    today = date.timetuple()
+
+    def scan():
+        return [rule for rule in rules if recur.rule_matches(rule, today)]
+
+    assert scan() == recur.rules_on(rules, index, date)
+    params = {'rules': num_rules}
+    return [
+        {
+            'function': 'index_rules',
+            **params,
+            'seconds': timed(recur.index_rules, rules, repeat=3),
+        },
+        {
+            'function': 'rules_on',
+            'mode': 'scan',
+            **params,
+            'seconds': timed(scan, repeat=3),
+        },
+        {
+            'function': 'rules_on',
+            'mode': 'index',
+            **params,
+            'seconds': timed(recur.rules_on, rules, index, date, repeat=3),
+        },
+    ]
+
+
+def bench_search(todo_dir, sizes, terms=('plumber',)):
+    """Compare searching the archive by index against grepping it with `todo done`.
+
+    The index is built in the first search (cold) and used by the next (warm),
+    after a task was archived it only indexes that one (appended).
+    """
+
+    done_file = os.path.join(todo_dir, 'done.md')
+    done_dir = os.path.join(todo_dir, 'done')
+    generate_todo_file(recur.TODO_FILE, 1000)
+    search_file = todolist.get_sidecar_file(recur.TODO_FILE, 'search')
+    results = []
+    for size in sizes:
+        generate_todo_file(done_file, size)
+        if os.path.exists(search_file):
+            os.remove(search_file)
+        params = {'lines': size}
+
+        def search():
+            todolist.run('search', terms, recur.TODO_FILE, 0, done_file, done_dir)
+
+        def append():
+            with open(done_file, 'a') as fd:
+                fd.write('- [x] call the plumber\n')
+
+        results += [
+            {'mode': 'cold', **params, 'seconds': timed(search)},
+            {'mode': 'warm', **params, 'seconds': timed(search, repeat=3)},
+            {'mode': 'appended', **params, 'seconds': timed(search, setup=append)},
+            {
+                'mode': 'grep',
+                **params,
+                'seconds': timed(
+                    todolist.run,
+                    'done',
+                    terms,
+                    recur.TODO_FILE,
+                    0,
+                    done_file,
+                    done_dir,
+                    repeat=3,
+                ),
+            },
+        ]
+    return results
+
+
+SCAN_CODE = '''
+import sys, time, resource
+sys.path.insert(0, {base_dir!r})
+import todolist
+start = time.perf_counter()
+if {mode!r} == 'read':
+    with open({path!r}, 'rb') as fd:
+        lines = [line for line in fd.read().splitlines() if {needle!r} in line]
+else:
+    lines = [line for start, line in todolist.scan_lines({path!r}, {needle!r})]
+duration = time.perf_counter() - start
+print(duration, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def bench_mmap(todo_dir, sizes, size_mb=500):
+    """Compare reading a large archive into memory against scanning it with mmap.
+
+    Each variant runs in its own process, so its peak RSS can be reported next
+    to the time it took.
+    """
+
+    done_file = os.path.join(todo_dir, 'done.md')
+    generate_todo_file(done_file, 10000)
+    with open(done_file, 'rb') as fd:
+        block = fd.read()
+    with open(done_file, 'ab') as fd:
+        for _ in range(size_mb * 2**20 // len(block)):
+            fd.write(block)
+    needle = f' t:{datetime.date.today().isoformat()}'.encode()
+
+    results = []
+    for mode in ('read', 'mmap'):
+        code = SCAN_CODE.format(
+            base_dir=BASE_DIR, mode=mode, path=done_file, needle=needle
+        )
+        output = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, check=True, text=True
+        ).stdout
+        seconds, max_rss = output.split()
+        results.append(
+            {
+                'mode': mode,
+                'megabytes': size_mb,
+                'seconds': float(seconds),
+                'max_rss_kb': int(max_rss),
+            }
+        )
+    return results
+
+
+BENCHMARKS = [
+    bench_add_tasks,
+    bench_archive,
+    bench_workspace,
+    bench_daemon,
+    bench_todo_actions,
+    bench_startup,
+    bench_recur,
+    bench_rules,
+    bench_search,
+    bench_mmap,
+]
+
+MEASURES = ('seconds', 'max_rss_kb')
+
+
+def format_result(result):
+    """Format a result record as a line like `recur mode=cold lines=1000: 0.012s`."""
+    params = ' '.join(
+        f'{key}={value}'
+        for key, value in result.items()
+        if key not in ('benchmark', *MEASURES)
+    )
+    line = f'{result["benchmark"]} {params}: {result["seconds"]:.6f}s'
+    if 'max_rss_kb' in result:
+        line += f' {result["max_rss_kb"] // 1024}MB'
+    return line
+
+
+def compare_results(results, baseline, tolerance):
+    """Get the results that are more than tolerance times slower than the baseline."""
+
+    key = lambda result: tuple(
+        sorted((k, v) for k, v in result.items() if k not in MEASURES)
+    )
+    baseline = {key(result): result['seconds'] for result in baseline}
+    return [
+        result
+        for result in results
+        if key(result) in baseline
+        and result['seconds'] > baseline[key(result)] * tolerance
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        'benchmarks',
+        nargs='*',
+        help='Benchmarks to run, eg. todo_actions, by default all of them',
+    )
+    parser.add_argument(
+        '--sizes',
+        type=lambda sizes: [int(size) for size in sizes.split(',')],
+        default=SIZES,
+        help='Comma separated todo file sizes in lines, eg. 1000,1000000',
+    )
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='Write the results as JSON to stdout',
+    )
+    parser.add_argument(
+        '--compare',
+        help='Exit with 1 if a result is slower than in this JSON results file',
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=1.5,
+        help='Factor a result may be slower than with --compare, default 1.5',
+    )
+    args = parser.parse_args(argv)
+
+    names = [name.replace('bench_', '') for name in args.benchmarks]
+    results = []
+    todo_dir = tempfile.mkdtemp()
+    try:
+        recur.set_dirs(todo_dir)
+        for benchmark in BENCHMARKS:
+            name = benchmark.__name__.replace('bench_', '')
+            if names and name not in names:
+                continue
+            for result in benchmark(todo_dir, args.sizes):
+                result = {'benchmark': name, **result}
+                results.append(result)
+                if not args.json:
+                    print(format_result(result), flush=True)
+    finally:
+        shutil.rmtree(todo_dir)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as fd:
+            regressions = compare_results(results, json.load(fd), args.tolerance)
+        for result in regressions:
+            print(f'slower than baseline: {format_result(result)}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
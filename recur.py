@@ -1,25 +1,51 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import re
 import os
 import sys
+import json
 import time
+import hashlib
 import logging
-import argparse
 import datetime
+import calendar
+import contextlib
+import collections
+
+import todolist
 
 TODO_DIR = os.path.dirname(os.path.realpath(__file__))
 
-logging.basicConfig(format='%(asctime)-15s %(levelname)s %(module)s: %(message)s')
 log = logging.getLogger(__name__)
 
-TASK_RE = re.compile(
+TASK_RE = todolist.LazyRegex(
     r'- \[.]\s*(?P<priority>([A-Z]))? (?P<task_head>.* )t:(?P<date>[^ ]*)(?P<task_tail>.*)'
 )
-REMINDER_RE = re.compile(r'{([^}]+)}')
-WARNING_RE = re.compile(r' \+(\d+)$')
-REPEAT_RE = re.compile(r' \*(\d+)$')
+REMINDER_RE = todolist.LazyRegex(r'{([^}]+)}')
+WARNING_RE = todolist.LazyRegex(r' \+(\d+)$')
+REPEAT_RE = todolist.LazyRegex(r' \*(\d+)$')
+INTERVAL_RE = todolist.LazyRegex(
+    r'(?i)every (?:(\d+) )?(day|week)s? from (\d{4}-\d{2}-\d{2})$'
+)
+NTH_WEEKDAY_RE = todolist.LazyRegex(r'(?i)(?:([1-5])(?:st|nd|rd|th)|last) (\S+)$')
+# Bump when the compiled rule format changes to invalidate existing caches.
+RULES_CACHE_VERSION = 5
+# Sample years for the buckets of yearly rules, the buckets are keyed by (month,
+# day) and serve every year. Which days a window spans only depends on whether
+# the event's year or the one before or after is a leap year. 2022 to 2025 have
+# each of these cases, eg. 2024 is a leap year and 2022 sits between two
+# ordinary years. A year outside the range, like 2026, is one of these cases too.
+INDEX_SAMPLE_YEARS = range(2022, 2026)
+# Kinds of rules whose buckets in the rule index only hold rules firing on that day.
+EXACT_KINDS = {
+    'single_day',
+    'multi_day',
+    'single_weekday',
+    'multi_weekday',
+    'weekday_range',
+}
+# Names of the profiling phases per kind of rule, built once per kind by rules_on.
+RULE_PHASES = {}
 DESCRIPTION = """
 Adds tasks from recur.txt that match today's date to todo file
 
@@ -33,26 +59,234 @@ Date format based on that used by remind:
 {Nov 22 2007} Eat turkey
 {Nov 27 *5} Keep adding task for 5 days after event
 {Dec 01 +3} Add task 5 days before specified date
+{Mon-Fri} check the mail on workdays
+{2nd Tue} every second Tuesday of the month
+{last Fri} the last Friday of the month
+{last} the last day of the month
+{every 2 weeks from 2026-01-05} every other Monday, starting on that date
+{every 10 days from 2026-01-01} every tenth day
 """
+# Names accepted for weekdays (0 is Monday) and months, more can be added with add_aliases.
+WEEKDAY_ALIASES = {
+    0: ['mo', 'mon', 'monday'],
+    1: ['tu', 'tue', 'tues', 'tuesday'],
+    2: ['we', 'wed', 'wednesday'],
+    3: ['th', 'thu', 'thur', 'thurs', 'thursday'],
+    4: ['fr', 'fri', 'friday'],
+    5: ['sa', 'sat', 'saturday'],
+    6: ['su', 'sun', 'sunday'],
+}
+MONTH_ALIASES = {
+    1: ['jan', 'january'],
+    2: ['feb', 'february'],
+    3: ['mar', 'march'],
+    4: ['apr', 'april'],
+    5: ['may'],
+    6: ['jun', 'june'],
+    7: ['jul', 'july'],
+    8: ['aug', 'august'],
+    9: ['sep', 'sept', 'september'],
+    10: ['oct', 'october'],
+    11: ['nov', 'november'],
+    12: ['dec', 'december'],
+}
+WEEKDAYS = {}
+MONTHS = {}
+
+
+Rule = collections.namedtuple(
+    'Rule', ['pattern', 'kind', 'values', 'warning_days', 'repeat_days', 'tasks']
+)
+
+
+class Stats:
+    """Timings of the phases of a run and counters, collected with --profile."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = collections.defaultdict(lambda: [0, 0.0])
+        self.counters = collections.Counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phase = self.phases[name]
+            phase[0] += 1
+            phase[1] += time.perf_counter() - start
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def as_dict(self):
+        return {
+            'total': time.perf_counter() - self.start,
+            'phases': {
+                name: {'calls': calls, 'seconds': seconds}
+                for name, (calls, seconds) in self.phases.items()
+            },
+            'counters': dict(self.counters),
+        }
+
+    def summary(self):
+        """Get the timings and counters as a table."""
+
+        stats = self.as_dict()
+        lines = [f'{"phase":<24} {"calls":>8} {"seconds":>10}']
+        for name, phase in stats['phases'].items():
+            lines.append(f'{name:<24} {phase["calls"]:>8} {phase["seconds"]:>10.6f}')
+        lines.append(f'{"total":<24} {"":>8} {stats["total"]:>10.6f}')
+        lines.append('')
+        lines.append(f'{"counter":<24} {"value":>8}')
+        for name, value in stats['counters'].items():
+            lines.append(f'{name:<24} {value:>8}')
+        return lines
+
+
+class NullStats:
+    """Stand-in for Stats when profiling is disabled, every call is a no-op."""
+
+    null_phase = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self.null_phase
+
+    def count(self, name, value=1):
+        pass
+
+
+# Replaced by a Stats instance with --profile
+STATS = NullStats()
 
 
 def set_dirs(todo_dir):
     """Set global paths for recurrence and todo files."""
-    global RECUR_FILE, TODO_FILE
+    global RECUR_FILE, TODO_FILE, LAST_RUN_FILE
 
     RECUR_FILE = os.path.join(todo_dir, 'recur.txt')
     TODO_FILE = os.path.join(todo_dir, 'todo.md')
-    log.info(f'Using file for recurring records: {RECUR_FILE}')
+    LAST_RUN_FILE = os.path.join(todo_dir, '.recur.last')
+    log.info('Using file for recurring records: %s', RECUR_FILE)
     return True
 
 
+def add_aliases(weekdays=None, months=None):
+    """Register additional names for weekdays (0 is Monday) and months (1 is January)."""
+
+    for weekday, names in (weekdays or {}).items():
+        for name in names:
+            WEEKDAYS[name.lower()] = weekday
+    for month, names in (months or {}).items():
+        for name in names:
+            MONTHS[name.lower()] = month
+
+
+def add_locale_aliases(locale_name):
+    """Register the weekday and month names of a locale. Eg. de_DE.UTF-8"""
+
+    with calendar.different_locale(locale_name):
+        weekdays = {
+            i: [calendar.day_name[i], calendar.day_abbr[i].rstrip('.')]
+            for i in range(7)
+        }
+        months = {
+            i: [calendar.month_name[i], calendar.month_abbr[i].rstrip('.')]
+            for i in range(1, 13)
+        }
+    add_aliases(weekdays=weekdays, months=months)
+
+
+add_aliases(weekdays=WEEKDAY_ALIASES, months=MONTH_ALIASES)
+
+
+def parse_day(day_str):
+    """Parse a one or two digit day of month, or None."""
+    if day_str.isdigit() and len(day_str) <= 2 and 1 <= int(day_str) <= 31:
+        return int(day_str)
+    return None
+
+
+def parse_month_day(reminder_str, year=2000):
+    """Parse a reminder like "Nov 22" into (month, day), or None.
+
+    The day is validated against a leap year by default, so Feb 29 is accepted.
+    """
+
+    tokens = reminder_str.split()
+    if len(tokens) != 2:
+        return None
+    month = MONTHS.get(tokens[0].lower())
+    day = parse_day(tokens[1])
+    if month is None or day is None or day > calendar.monthrange(year, month)[1]:
+        return None
+    return month, day
+
+
+def parse_month_day_year(reminder_str):
+    """Parse a reminder like "Nov 22 2007" into (year, month, day), or None."""
+
+    tokens = reminder_str.split()
+    if len(tokens) != 3 or len(tokens[2]) != 4 or not tokens[2].isdigit():
+        return None
+    year = int(tokens[2])
+    month_day = parse_month_day(' '.join(tokens[:2]), year)
+    if year < 1 or month_day is None:
+        return None
+    return (year, *month_day)
+
+
+def parse_interval(reminder_str):
+    """Parse a reminder like "every 2 weeks from 2026-01-05" into (first ordinal, days), or None."""
+
+    match = INTERVAL_RE.match(reminder_str)
+    if match is None:
+        return None
+    count, unit, date_str = match.groups()
+    try:
+        first_date = datetime.date.fromisoformat(date_str)
+    except ValueError:
+        return None
+    days = int(count or 1) * (7 if unit.lower() == 'week' else 1)
+    if days == 0:
+        return None
+    return first_date.toordinal(), days
+
+
+def parse_nth_weekday(reminder_str):
+    """Parse a reminder like "2nd Tue" or "last Fri" into (n, weekday), or None.
+
+    n counts the weekdays of the month from 1, the last one is -1.
+    """
+
+    match = NTH_WEEKDAY_RE.match(reminder_str)
+    if match is None:
+        return None
+    weekday = WEEKDAYS.get(match.group(2).lower())
+    if weekday is None:
+        return None
+    return int(match.group(1) or -1), weekday
+
+
+def parse_weekday_range(reminder_str):
+    """Parse a reminder like "Mon-Fri" into its weekdays, or None. Ranges can wrap, eg. Fri-Mon."""
+
+    first, sep, last = reminder_str.partition('-')
+    first = WEEKDAYS.get(first.lower())
+    last = WEEKDAYS.get(last.lower())
+    if not sep or first is None or last is None:
+        return None
+    return tuple((first + i) % 7 for i in range((last - first) % 7 + 1))
+
+
 def single_day(reminder_str, today):
     """Check if a single day reminder matches today's time struct. Eg. {22}"""
 
     if reminder_str.isdigit():
         reminder_day = int(reminder_str)
         if reminder_day == today.tm_mday:
-            log.debug(f'Parsed "{reminder_str}" as "single_day"')
+            log.debug('Parsed "%s" as "single_day"', reminder_str)
             return True, True
         else:
             return True, False
@@ -63,118 +297,124 @@ def single_day(reminder_str, today):
 def single_weekday(reminder_str, today):
     """Check if a single day of week reminder matches today's time struct. Eg. {Mon}"""
 
-    try:
-        reminder_weekday = time.strptime(reminder_str, '%a')
-        log.debug(reminder_weekday)
-        if reminder_weekday.tm_wday == today.tm_wday:
-            log.debug(f'Parsed "{reminder_str}" as "single_weekday"')
-            return True, True
-        else:
-            return True, False
-    except ValueError:
+    reminder_weekday = WEEKDAYS.get(reminder_str.lower())
+    if reminder_weekday is None:
         return False, False
+    if reminder_weekday == today.tm_wday:
+        log.debug('Parsed "%s" as "single_weekday"', reminder_str)
+        return True, True
+    else:
+        return True, False
 
 
 def month_day(reminder_str, today, warning_days=0, repeat_days=0):
     """Check if a month-day reminder matches today's time structs, with optional warning or repeat. Eg. {Nov 22}"""
-    try:
-        reminder_time = time.strptime(
-            f'{reminder_str} {today.tm_year}',
-            '%b %d %Y',
-        )
-        current_date = datetime.date(
-            today.tm_year,
-            today.tm_mon,
-            today.tm_mday,
-        )
-
-        if warning_days:
-            # Check if the event date falls within the warning period (days before)
-            for i in range(1, warning_days):
-                future_date = current_date + datetime.timedelta(days=i)
-                event_date = datetime.date(
-                    future_date.year,
-                    reminder_time.tm_mon,
-                    reminder_time.tm_mday,
-                )
-                if event_date == future_date:
-                    log.debug(f'Parsed "{reminder_str}" as "month_day" with warnings')
-                    return True, True
-
-        if repeat_days:
-            # Check if the event date falls within the repeat period (days after)
-            for i in range(1, repeat_days):
-                past_date = current_date - datetime.timedelta(days=i)
-                event_date = datetime.date(
-                    past_date.year,
-                    reminder_time.tm_mon,
-                    reminder_time.tm_mday,
-                )
-                if event_date == past_date:
-                    log.debug(f'Parsed "{reminder_str}" as "month_day" with repeats')
-                    return True, True
-
-        # Check if the event month and day match today's month and day
-        if (
-            reminder_time.tm_mon == today.tm_mon
-            and reminder_time.tm_mday == today.tm_mday
-        ):
-            return True, True
-        else:
-            return True, False
-    except ValueError:
+    # Parsed against a leap year so that Feb 29 is accepted in every year.
+    reminder_month_day = parse_month_day(reminder_str)
+    if reminder_month_day is None:
         return False, False
 
+    is_today_match = month_day_match(
+        *reminder_month_day,
+        today,
+        warning_days=warning_days,
+        repeat_days=repeat_days,
+    )
+    if is_today_match:
+        log.debug('Parsed "%s" as "month_day"', reminder_str)
+    return True, is_today_match
+
+
+def month_day_match(month, day, today, warning_days=0, repeat_days=0):
+    """Check if an already parsed month and day match today's time struct, with optional warning or repeat."""
+
+    current_date = datetime.date(
+        today.tm_year,
+        today.tm_mon,
+        today.tm_mday,
+    )
+
+    days_before = max(warning_days - 1, 0)
+    days_after = max(repeat_days - 1, 0)
+
+    # Check if the next event date falls within the warning period (days before)
+    next_date = next_month_day(month, day, current_date)
+    if next_date and (next_date - current_date).days <= days_before:
+        return True
+
+    # Check if the previous event date falls within the repeat period (days after)
+    previous_date = previous_month_day(month, day, current_date)
+    if previous_date and (current_date - previous_date).days <= days_after:
+        return True
+
+    return False
+
+
+def next_month_day(month, day, date):
+    """Get the first date on or after date that falls on month and day, or None."""
+
+    # Feb 29 can be up to eight years away, eg. from 2096 to 2104.
+    for year in range(date.year, date.year + 9):
+        try:
+            event_date = datetime.date(year, month, day)
+        except ValueError:
+            continue
+        if event_date >= date:
+            return event_date
+    return None
+
+
+def previous_month_day(month, day, date):
+    """Get the last date on or before date that falls on month and day, or None."""
+
+    for year in range(date.year, date.year - 9, -1):
+        try:
+            event_date = datetime.date(year, month, day)
+        except ValueError:
+            continue
+        if event_date <= date:
+            return event_date
+    return None
+
 
 def month_day_year(reminder_str, today, warning_days=0, repeat_days=0):
     """Check if a specific month-day-year event matches today's time struct, with optional warning or repeat. Eg. {Nov 22 2007}"""
 
-    try:
-        reminder_time = time.strptime(reminder_str, '%b %d %Y')
-        reminder_date = datetime.date(
-            reminder_time.tm_year,
-            reminder_time.tm_mon,
-            reminder_time.tm_mday,
-        )
-        current_date = datetime.date(
-            today.tm_year,
-            today.tm_mon,
-            today.tm_mday,
-        )
-
-        if warning_days:
-            for i in range(1, warning_days):
-                future_date = reminder_date - datetime.timedelta(days=i)
-                if future_date == current_date:
-                    log.debug(
-                        f'Parsed "{reminder_str}" as "month_day_year" with warnings'
-                    )
-                    return True, True
-
-        if repeat_days:
-            for i in range(1, repeat_days):
-                past_date = reminder_date + datetime.timedelta(days=i)
-                if past_date == current_date:
-                    log.debug(
-                        f'Parsed "{reminder_str}" as "month_day_year" with repeats'
-                    )
-                    return True, True
-
-        if reminder_date == current_date:
-            log.debug(f'Parsed "{reminder_str}" as "month_day_year"')
-            return True, True
-        else:
-            return True, False
-    except ValueError:
+    reminder_month_day_year = parse_month_day_year(reminder_str)
+    if reminder_month_day_year is None:
         return False, False
 
+    is_today_match = month_day_year_match(
+        datetime.date(*reminder_month_day_year),
+        today,
+        warning_days=warning_days,
+        repeat_days=repeat_days,
+    )
+    if is_today_match:
+        log.debug('Parsed "%s" as "month_day_year"', reminder_str)
+    return True, is_today_match
+
+
+def month_day_year_match(reminder_date, today, warning_days=0, repeat_days=0):
+    """Check if an already parsed event date matches today's time struct."""
+
+    current_date = datetime.date(
+        today.tm_year,
+        today.tm_mon,
+        today.tm_mday,
+    )
+    days_until_event = (reminder_date - current_date).days
+    return (
+        -max(repeat_days - 1, 0) <= days_until_event <= max(warning_days - 1, 0)
+    )
+
 
 def has_warning(reminder_str):
     """Extract warning days from a reminder. Eg. {Nov 22 +5}"""
 
-    match = re.search(WARNING_RE, reminder_str)
+    match = WARNING_RE.search(reminder_str)
     if match:
-        remainder_reminder_str = re.sub(WARNING_RE, '', reminder_str)
+        remainder_reminder_str = WARNING_RE.sub('', reminder_str)
         return match.group(1), remainder_reminder_str
     else:
         return False, False
@@ -183,9 +423,9 @@ def has_warning(reminder_str):
 def has_repeat(reminder_str):
     """Extract repeat days from a reminder. Eg. {Nov 22 *5}"""
 
-    match = re.search(REPEAT_RE, reminder_str)
+    match = REPEAT_RE.search(reminder_str)
     if match:
-        remainder_reminder_str = re.sub(REPEAT_RE, '', reminder_str)
+        remainder_reminder_str = REPEAT_RE.sub('', reminder_str)
         return match.group(1), remainder_reminder_str
     else:
         return False, False
@@ -201,7 +441,7 @@ def multi_weekday(reminder_str, today):
             # If any part fails to parse, the whole multi-day string is considered invalid.
             return False, False
         if is_today_match:
-            log.debug(f'Parsed "{reminder_str}" as "multi_weekday"')
+            log.debug('Parsed "%s" as "multi_weekday"', reminder_str)
             return True, True
     return True, False
 
@@ -216,15 +456,87 @@ def multi_day(reminder_str, today):
             # If any part fails to parse, the whole multi-day string is considered invalid.
             return False, False
         if is_today_match:
-            log.debug(f'Parsed "{reminder_str}" as "multi_day"')
+            log.debug('Parsed "%s" as "multi_day"', reminder_str)
             return True, True
     return True, False
 
 
+def interval(reminder_str, today):
+    """Check if an interval reminder matches today's time struct. Eg. {every 2 weeks from 2026-01-05}"""
+
+    reminder_interval = parse_interval(reminder_str)
+    if reminder_interval is None:
+        return False, False
+    is_today_match = interval_match(*reminder_interval, today)
+    if is_today_match:
+        log.debug('Parsed "%s" as "interval"', reminder_str)
+    return True, is_today_match
+
+
+def interval_match(first_ordinal, days, today):
+    """Check if today's time struct is a whole number of intervals on or after the first date."""
+
+    days_since = (
+        datetime.date(today.tm_year, today.tm_mon, today.tm_mday).toordinal()
+        - first_ordinal
+    )
+    return days_since >= 0 and days_since % days == 0
+
+
+def nth_weekday(reminder_str, today):
+    """Check if an nth weekday of the month reminder matches today's time struct. Eg. {2nd Tue} or {last Fri}"""
+
+    reminder_nth_weekday = parse_nth_weekday(reminder_str)
+    if reminder_nth_weekday is None:
+        return False, False
+    is_today_match = nth_weekday_match(*reminder_nth_weekday, today)
+    if is_today_match:
+        log.debug('Parsed "%s" as "nth_weekday"', reminder_str)
+    return True, is_today_match
+
+
+def nth_weekday_match(n, weekday, today):
+    """Check if today's time struct is the nth (or with -1 the last) weekday of its month."""
+
+    if today.tm_wday != weekday:
+        return False
+    if n == -1:
+        return today.tm_mday + 7 > calendar.monthrange(today.tm_year, today.tm_mon)[1]
+    return (today.tm_mday - 1) // 7 + 1 == n
+
+
+def last_day(reminder_str, today):
+    """Check if a last day of the month reminder matches today's time struct. Eg. {last}"""
+
+    if reminder_str.lower() != 'last':
+        return False, False
+    is_today_match = last_day_match(today)
+    if is_today_match:
+        log.debug('Parsed "%s" as "last_day"', reminder_str)
+    return True, is_today_match
+
+
+def last_day_match(today):
+    """Check if today's time struct is the last day of its month."""
+    return today.tm_mday == calendar.monthrange(today.tm_year, today.tm_mon)[1]
+
+
+def weekday_range(reminder_str, today):
+    """Check if a range of weekdays matches today's time struct. Eg. {Mon-Fri}"""
+
+    weekdays = parse_weekday_range(reminder_str)
+    if weekdays is None:
+        return False, False
+    is_today_match = today.tm_wday in weekdays
+    if is_today_match:
+        log.debug('Parsed "%s" as "weekday_range"', reminder_str)
+    return True, is_today_match
+
+
 def parse_rem(reminder_str, today):
     """Parses REM style date strings - returns True if event is today."""
 
-    log.debug(f'Trying to parse "{reminder_str}"')
+    log.debug('Trying to parse "%s"', reminder_str)
 
     warning_days = 0
     repeat_days = 0
@@ -254,67 +566,426 @@ def parse_rem(reminder_str, today):
     if is_parsed_ok and not is_today_match:
         return False
 
-    is_parsed_ok, is_today_match = single_weekday(reminder_str, today)
+    # Dates before weekdays, weekday names of other locales can also be months
+    is_parsed_ok, is_today_match = month_day(
+        reminder_str, today, warning_days=warning_days, repeat_days=repeat_days
+    )
     if is_parsed_ok and is_today_match:
         return True
     if is_parsed_ok and not is_today_match:
         return False
 
-    is_parsed_ok, is_today_match = multi_weekday(reminder_str, today)
+    is_parsed_ok, is_today_match = month_day_year(
+        reminder_str, today, warning_days=warning_days, repeat_days=repeat_days
+    )
     if is_parsed_ok and is_today_match:
         return True
     if is_parsed_ok and not is_today_match:
         return False
 
-    is_parsed_ok, is_today_match = month_day(
-        reminder_str, today, warning_days=warning_days, repeat_days=repeat_days
-    )
+    is_parsed_ok, is_today_match = single_weekday(reminder_str, today)
     if is_parsed_ok and is_today_match:
         return True
     if is_parsed_ok and not is_today_match:
         return False
 
-    is_parsed_ok, is_today_match = month_day_year(
-        reminder_str, today, warning_days=warning_days, repeat_days=repeat_days
-    )
+    is_parsed_ok, is_today_match = multi_weekday(reminder_str, today)
     if is_parsed_ok and is_today_match:
         return True
     if is_parsed_ok and not is_today_match:
         return False
 
+    for parser in (weekday_range, nth_weekday, last_day, interval):
+        is_parsed_ok, is_today_match = parser(reminder_str, today)
+        if is_parsed_ok:
+            return is_today_match
 
-def add_today_tasks(config_file):
-    """Add tasks occurring today from the config file to the todo list."""
 
-    today = time.localtime()
-    today_date_str = time.strftime('%F', today)
-    reminders_config = get_dict(config_file)
+def compile_reminder(reminder_str):
+    """Parse a REM style date string once into (kind, values, warning_days, repeat_days).
 
-    for date_pattern_str, tasks in reminders_config.items():
-        log.info(f'Processing item [{date_pattern_str}] = {tasks}')
+    The kinds are tried in the same order as parse_rem, so a compiled reminder
+    matches exactly the days parse_rem would match.
+    """
+
+    warning_days = 0
+    repeat_days = 0
 
-        matched_date_group = re.search(REMINDER_RE, date_pattern_str)
+    warning_days_str, processed_reminder_str = has_warning(reminder_str)
+    if warning_days_str:
+        warning_days = int(warning_days_str)
+        reminder_str = processed_reminder_str
+
+    repeat_days_str, processed_reminder_str = has_repeat(reminder_str)
+    if repeat_days_str:
+        repeat_days = int(repeat_days_str)
+        reminder_str = processed_reminder_str
+
+    if reminder_str.isdigit():
+        return 'single_day', (int(reminder_str),), warning_days, repeat_days
+
+    tokens = reminder_str.split()
+    if not tokens or tokens[0].isdigit():
+        # Like multi_day, only the days before the first invalid token can ever match.
+        days = []
+        for token in tokens:
+            if not token.isdigit():
+                break
+            days.append(int(token))
+        return 'multi_day', tuple(days), warning_days, repeat_days
+
+    # Dates go first, a weekday name of another locale can also be a month, eg.
+    # "mar" is Tuesday in Spanish and {Mar 15} has to stay March 15.
+    reminder_month_day = parse_month_day(reminder_str)
+    if reminder_month_day is not None:
+        return 'month_day', reminder_month_day, warning_days, repeat_days
+
+    reminder_month_day_year = parse_month_day_year(reminder_str)
+    if reminder_month_day_year is not None:
+        return 'month_day_year', reminder_month_day_year, warning_days, repeat_days
+
+    weekdays = []
+    for token in tokens:
+        weekday = WEEKDAYS.get(token.lower())
+        if weekday is None:
+            break
+        weekdays.append(weekday)
+    if weekdays:
+        kind = 'single_weekday' if len(tokens) == 1 else 'multi_weekday'
+        return kind, tuple(weekdays), warning_days, repeat_days
+
+    weekdays = parse_weekday_range(reminder_str)
+    if weekdays is not None:
+        return 'weekday_range', weekdays, warning_days, repeat_days
+
+    reminder_nth_weekday = parse_nth_weekday(reminder_str)
+    if reminder_nth_weekday is not None:
+        return 'nth_weekday', reminder_nth_weekday, warning_days, repeat_days
+
+    if reminder_str.lower() == 'last':
+        return 'last_day', (), warning_days, repeat_days
+
+    reminder_interval = parse_interval(reminder_str)
+    if reminder_interval is not None:
+        return 'interval', reminder_interval, warning_days, repeat_days
+
+    return 'invalid', (), warning_days, repeat_days
+
+
+def compile_rules(reminders_config):
+    """Compile the result of get_dict into a list of rules."""
+
+    rules = []
+    for date_pattern_str, tasks in reminders_config.items():
+        matched_date_group = REMINDER_RE.search(date_pattern_str)
         if matched_date_group:
-            # matched_date_group.group(1) is the date in Remind format (e.g., Wed, 18 +3, Jan 26 +4)
-            is_match_today = parse_rem(matched_date_group.group(1), today)
-            if is_match_today:
-                for task in tasks:
-                    if task_exists(task, today_date_str):
-                        log.info(f'Task already exists: {task}')
+            kind, values, warning_days, repeat_days = compile_reminder(
+                matched_date_group.group(1)
+            )
+        else:
+            kind, values, warning_days, repeat_days = None, (), 0, 0
+        rules.append(
+            Rule(date_pattern_str, kind, values, warning_days, repeat_days, tasks)
+        )
+    return rules
+
+
+def rule_matches(rule, today):
+    """Check if a compiled rule matches today's time struct."""
+
+    if rule.kind in ('single_day', 'multi_day'):
+        return today.tm_mday in rule.values
+    if rule.kind in ('single_weekday', 'multi_weekday', 'weekday_range'):
+        return today.tm_wday in rule.values
+    if rule.kind == 'nth_weekday':
+        return nth_weekday_match(*rule.values, today)
+    if rule.kind == 'last_day':
+        return last_day_match(today)
+    if rule.kind == 'interval':
+        return interval_match(*rule.values, today)
+    if rule.kind == 'month_day':
+        return month_day_match(
+            *rule.values,
+            today,
+            warning_days=rule.warning_days,
+            repeat_days=rule.repeat_days,
+        )
+    if rule.kind == 'month_day_year':
+        return month_day_year_match(
+            datetime.date(*rule.values),
+            today,
+            warning_days=rule.warning_days,
+            repeat_days=rule.repeat_days,
+        )
+    return False
+
+
+def index_key(kind, *values):
+    """Get the key of a bucket of the rule index, a string so the index can be cached as JSON."""
+    return ' '.join([kind, *map(str, values)])
+
+
+def index_rules(rules):
+    """Bucket the positions of compiled rules by the days they can fire on.
+
+    Day of month and weekday rules go into one bucket per day they name.
+    Month-day rules have their warning and repeat windows expanded into a bucket
+    for every (month, day) the window covers in any year, rules with a window
+    of a year or more are checked every day. Nth weekday, last day of the month
+    and interval rules go into the buckets of the weekdays or days they can fall
+    on, intervals that are not whole weeks are checked every day. Only day of
+    month and weekday buckets are exact, rules_on checks the other rules
+    against the date.
+    """
+
+    index = collections.defaultdict(list)
+    for position, rule in enumerate(rules):
+        if rule.kind in ('single_day', 'multi_day'):
+            keys = {index_key('day', day) for day in rule.values}
+        elif rule.kind in ('single_weekday', 'multi_weekday', 'weekday_range'):
+            keys = {index_key('weekday', weekday) for weekday in rule.values}
+        elif rule.kind == 'nth_weekday':
+            keys = {index_key('weekday', rule.values[1])}
+        elif rule.kind == 'last_day':
+            keys = {index_key('day', day) for day in range(28, 32)}
+        elif rule.kind == 'interval':
+            first_ordinal, days = rule.values
+            if days % 7:
+                keys = {'always'}
+            else:
+                keys = {index_key('weekday', (first_ordinal - 1) % 7)}
+        elif rule.kind in ('month_day', 'month_day_year'):
+            days_before = max(rule.warning_days - 1, 0)
+            days_after = max(rule.repeat_days - 1, 0)
+            if days_before + days_after >= 365:
+                keys = {'always'}
+            else:
+                keys = set()
+                month, day = rule.values[-2:]
+                years = INDEX_SAMPLE_YEARS if rule.kind == 'month_day' else rule.values[:1]
+                for year in years:
+                    try:
+                        event_date = datetime.date(year, month, day)
+                    except ValueError:
                         continue
-                    log.info(f'Adding task: {task}')
-                    add_task(task, today_date_str)
+                    for offset in range(-days_before, days_after + 1):
+                        date = event_date + datetime.timedelta(days=offset)
+                        keys.add(index_key('date', date.month, date.day))
         else:
-            log.info(f'Unable to parse date from "{date_pattern_str} {tasks}"')
+            keys = {'invalid'}
+        for key in keys:
+            index[key].append(position)
+    return dict(index)
+
+
+def rules_on(rules, index, date):
+    """Get the rules that fire on a date from the rule index, in the order of the config."""
+
+    positions = []
+    for key in (
+        index_key('day', date.day),
+        index_key('weekday', date.weekday()),
+        index_key('date', date.month, date.day),
+        'always',
+    ):
+        positions += index.get(key, ())
+    positions.sort()
+    STATS.count('rules_evaluated', len(positions))
+
+    today = None
+    matched = []
+    for position in positions:
+        rule = rules[position]
+        # Timed per kind of rule like before the index, to see which kind is slow
+        phase = RULE_PHASES.get(rule.kind)
+        if phase is None:
+            phase = RULE_PHASES[rule.kind] = f'rules.{rule.kind}'
+        with STATS.phase(phase):
+            if rule.kind not in EXACT_KINDS:
+                today = today or date.timetuple()
+                if not rule_matches(rule, today):
+                    continue
+            matched.append(rule)
+    return matched
+
+
+def iter_months(start_date, end_date):
+    """Get the (year, month) of every month between start_date and end_date (inclusive)."""
+
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def get_occurrences(rule, start_date, end_date):
+    """Get the set of dates between start_date and end_date (inclusive) a compiled rule fires on."""
+
+    occurrences = set()
+    if rule.kind in ('single_day', 'multi_day'):
+        for year, month in iter_months(start_date, end_date):
+            for day in rule.values:
+                try:
+                    occurrences.add(datetime.date(year, month, day))
+                except ValueError:
+                    continue
+
+    elif rule.kind in ('nth_weekday', 'last_day'):
+        for year, month in iter_months(start_date, end_date):
+            first_weekday, last_day = calendar.monthrange(year, month)
+            if rule.kind == 'last_day':
+                day = last_day
+            else:
+                n, weekday = rule.values
+                if n == -1:
+                    day = last_day - (first_weekday + last_day - 1 - weekday) % 7
+                else:
+                    day = 1 + (weekday - first_weekday) % 7 + 7 * (n - 1)
+            if day <= last_day:
+                occurrences.add(datetime.date(year, month, day))
+
+    elif rule.kind == 'interval':
+        first_ordinal, days = rule.values
+        # The first occurrence on or after start_date, ceiling division on the days since.
+        ordinal = first_ordinal + max(
+            -((first_ordinal - start_date.toordinal()) // days) * days, 0
+        )
+        while ordinal <= end_date.toordinal():
+            occurrences.add(datetime.date.fromordinal(ordinal))
+            ordinal += days
+
+    elif rule.kind in ('single_weekday', 'multi_weekday', 'weekday_range'):
+        for weekday in rule.values:
+            date = start_date + datetime.timedelta(
+                days=(weekday - start_date.weekday()) % 7
+            )
+            while date <= end_date:
+                occurrences.add(date)
+                date += datetime.timedelta(days=7)
+
+    elif rule.kind in ('month_day', 'month_day_year'):
+        days_before = max(rule.warning_days - 1, 0)
+        days_after = max(rule.repeat_days - 1, 0)
+        if rule.kind == 'month_day':
+            month, day = rule.values
+            # Include the event years whose warning or repeat window reaches into the range.
+            years = range(
+                start_date.year - days_after // 365 - 1,
+                end_date.year + days_before // 365 + 2,
+            )
+        else:
+            year, month, day = rule.values
+            years = [year]
+        for year in years:
+            try:
+                event_date = datetime.date(year, month, day)
+            except ValueError:
+                continue
+            date = max(event_date - datetime.timedelta(days=days_before), start_date)
+            last_date = min(event_date + datetime.timedelta(days=days_after), end_date)
+            while date <= last_date:
+                occurrences.add(date)
+                date += datetime.timedelta(days=1)
+
+    return {date for date in occurrences if start_date <= date <= end_date}
+
+
+def expand_rules(rules, start_date, end_date):
+    """Get all (date, task) pairs the rules fire on between start_date and end_date (inclusive)."""
+
+    occurrences = []
+    for rule in rules:
+        for date in get_occurrences(rule, start_date, end_date):
+            for task in rule.tasks:
+                occurrences.append((date, task))
+    occurrences.sort(key=lambda occurrence: occurrence[0])
+    return occurrences
+
+
+def add_today_tasks(config_file, since=None):
+    """Add tasks occurring today from the config file to the todo list.
+
+    Days missed since the last successful run (or since the given date) are
+    caught up in the same pass, each task with its own date. The rules of each
+    day are looked up in the rule index instead of checking every rule. The
+    lock of the todo list is held from the scan for existing tasks until the
+    new ones are written, so concurrent runs do not add the same task twice.
+    """
+
+    today = datetime.date.today()
+    if since is None:
+        last_run = get_last_run()
+        since = last_run + datetime.timedelta(days=1) if last_run else today
+    since = min(since, today)
+    if since < today:
+        log.info('Catching up on tasks since %s', since)
+
+    with STATS.phase('config'):
+        rules, index = get_rules_index(config_file)
+    for position in index.get('invalid', ()):
+        rule = rules[position]
+        log.info('Unable to parse date from "%s %s"', rule.pattern, rule.tasks)
+    with todolist.FileLock(TODO_FILE):
+        with STATS.phase('scan'):
+            task_index = get_task_index()
+        new_tasks = []
+        matched = set()
+        deduped = 0
+
+        date = since
+        while date <= today:
+            date_rules = rules_on(rules, index, date)
+            date_str = f'{date:%F}'
+            for rule in date_rules:
+                log.info('Processing item [%s] = %s', rule.pattern, rule.tasks)
+                matched.add(rule.pattern)
+                for task in rule.tasks:
+                    if task_exists(task, date_str, task_index):
+                        log.info('Task already exists: %s', task)
+                        deduped += 1
+                        continue
+                    log.info('Adding task: %s for %s', task, date_str)
+                    new_tasks.append((task, date_str))
+                    task_index.update(parse_task_keys(format_task(task, date_str)))
+            date += datetime.timedelta(days=1)
+
+        STATS.count('rules', len(rules))
+        STATS.count('rules_matched', len(matched))
+        STATS.count('tasks_deduped', deduped)
+        STATS.count('tasks_added', len(new_tasks))
+
+        with STATS.phase('write'):
+            add_tasks(new_tasks)
+            save_last_run(today)
+
+
+def get_last_run():
+    """Get the date of the last successful run, or None if there is none."""
+    try:
+        with open(LAST_RUN_FILE) as fd:
+            return datetime.date.fromisoformat(fd.read().strip())
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        log.warning('Ignoring invalid last run date in %s', LAST_RUN_FILE)
+        return None
 
 
-def task_exists(task, date_str):
-    """Check for an existing task for a given date in the TODO file."""
+def save_last_run(date):
+    """Store the date of a successful run in TODO_DIR."""
+    write_atomic(LAST_RUN_FILE, f'{date:%F}\n')
 
-    tasks = get_tasks(date_str)
-    log.debug(f'Tasks found for {date_str}: {tasks}')
-    log.debug(f'Checking for task: {task}')
-    if task in tasks:
+
+def task_exists(task, date_str, task_index=None):
+    """Check for an existing task for a given date in the TODO file.
+
+    Pass a prebuilt index from get_task_index() to avoid rereading the TODO file.
+    """
+
+    if task_index is None:
+        task_index = get_task_index()
+    log.debug('Checking for task: %s', task)
+    if (task, date_str) in task_index:
         return True
     else:
         return False
@@ -322,58 +993,222 @@ def task_exists(task, date_str):
 
 def get_dict(config_file):
     """Parse the recurrence config file into a dictionary."""
+    if not os.path.isfile(config_file):
+        log.error('Config file %s does not exist', config_file)
+        sys.exit(1)
+
+    with open(config_file) as fd:
+        return parse_config(fd.read().splitlines())
+
+
+def parse_config(lines):
+    """Parse recurrence config lines into a dictionary."""
     recurrence_config = {}
+    for line in lines:
+        pos = line.rfind('}')
+        if pos == -1:
+            log.error('Unable to parse line "%s"', line.strip())
+            continue
+        date = line[: pos + 1].strip()
+        task = line[pos + 1 :].strip()
+        if date in recurrence_config:
+            recurrence_config[date].append(task)
+        else:
+            recurrence_config[date] = [task]
+    return recurrence_config
+
+
+def get_rules_cache_file(config_file):
+    """Get the path of the compiled rules cache next to the config file."""
+    config_dir, config_name = os.path.split(os.path.abspath(config_file))
+    return os.path.join(config_dir, f'.{config_name}.cache')
+
+
+def get_rules(config_file):
+    """Get the compiled rules for the config file, reusing the cache if it is unchanged."""
+    return get_rules_index(config_file)[0]
+
+
+def get_rules_index(config_file):
+    """Get the compiled rules for the config file and their index from index_rules.
+
+    Both are cached, reusing the cache if the config file is unchanged.
+    """
     if not os.path.isfile(config_file):
-        log.error(f'Config file {config_file} does not exist')
+        log.error('Config file %s does not exist', config_file)
         sys.exit(1)
 
+    mtime = os.stat(config_file).st_mtime_ns
     with open(config_file) as fd:
-        for line in fd.readlines():
-            pos = line.rfind('}')
-            if pos == -1:
-                log.error(f'Unable to parse line "{line.strip()}"')
+        content = fd.read()
+    cache_key = {
+        'version': RULES_CACHE_VERSION,
+        'mtime': mtime,
+        'hash': hashlib.sha256(content.encode()).hexdigest(),
+        'aliases': get_aliases_hash(),
+    }
+    cache_file = get_rules_cache_file(config_file)
+
+    cache = load_rules_cache(cache_file, cache_key)
+    if cache is None:
+        log.info('Compiling rules from %s', config_file)
+        rules = compile_rules(parse_config(content.splitlines()))
+        index = index_rules(rules)
+        save_rules_cache(cache_file, cache_key, rules, index)
+    else:
+        rules, index = cache
+    return rules, index
+
+
+def get_aliases_hash():
+    """Hash the registered weekday and month names, rules compile differently when they change."""
+    aliases = json.dumps([sorted(WEEKDAYS.items()), sorted(MONTHS.items())])
+    return hashlib.sha256(aliases.encode()).hexdigest()
+
+
+def load_rules_cache(cache_file, cache_key):
+    """Load compiled rules and their index from the cache file, or None if it is missing or stale."""
+    try:
+        with open(cache_file) as fd:
+            cache = json.load(fd)
+    except (OSError, ValueError):
+        return None
+    if cache.get('key') != cache_key:
+        return None
+    log.info('Using cached rules from %s', cache_file)
+    rules = [
+        Rule(pattern, kind, tuple(values), warning_days, repeat_days, tasks)
+        for pattern, kind, values, warning_days, repeat_days, tasks in cache['rules']
+    ]
+    return rules, cache['index']
+
+
+def save_rules_cache(cache_file, cache_key, rules, index):
+    """Save compiled rules and their index to the cache file, a failure only costs recompiling next time."""
+    try:
+        write_atomic(
+            cache_file, json.dumps({'key': cache_key, 'rules': rules, 'index': index})
+        )
+    except OSError as e:
+        log.warning('Unable to write rules cache %s: %s', cache_file, e)
+
+
+def format_task(task, date_str):
+    """Format a task line as it is written to the TODO file."""
+    return f'- [ ] {task} t:{date_str}'
+
+
+def write_atomic(path, content, tail_file=None):
+    """Replace a file with new content via a synced temp file in the same directory.
+
+    The content of tail_file is streamed after the new content, so a file can
+    be prepended to without reading it into memory. If tail_file changes while
+    it is copied, eg. when it is saved from an editor, the copy starts over, up
+    to todolist.WRITE_ATTEMPTS times before raising todolist.WriteConflict.
+    """
+
+    import shutil
+    import tempfile
+
+    for attempt in range(todolist.WRITE_ATTEMPTS):
+        signature = tail_file and todolist.get_signature(tail_file)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)),
+            prefix=f'.{os.path.basename(path)}.',
+        )
+        try:
+            with os.fdopen(fd, 'w') as tmp:
+                tmp.write(content)
+                if tail_file:
+                    tmp.flush()
+                    with open(tail_file, 'rb') as tail:
+                        shutil.copyfileobj(tail, tmp.buffer)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            if tail_file and todolist.get_signature(tail_file) != signature:
+                log.warning('%s changed while writing it, retrying', tail_file)
+                os.unlink(tmp_path)
                 continue
-            date = line[: pos + 1].strip()
-            task = line[pos + 1 :].strip()
-            if date in recurrence_config:
-                recurrence_config[date].append(task)
-            else:
-                recurrence_config[date] = [task]
-    return recurrence_config
+            if os.path.exists(path):
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+            os.replace(tmp_path, path)
+            return
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    raise todolist.WriteConflict(f'{tail_file} kept changing while writing it')
+
+
+def add_tasks(tasks):
+    """Prepend new (task, date) entries to the TODO file in a single atomic write.
+
+    The write holds the lock of the TODO file, so it does not race with the
+    todo script or another run adding or archiving tasks.
+    """
+
+    if not tasks:
+        return
+    # Tasks used to be prepended one at a time, so the last one added ends up on top.
+    new_lines = ''.join(
+        f'{format_task(task, date_str)}\n' for task, date_str in reversed(tasks)
+    )
+    with todolist.FileLock(TODO_FILE):
+        write_atomic(TODO_FILE, new_lines, tail_file=TODO_FILE)
 
 
 def add_task(task, date_str):
     """Add a new task to the TODO file."""
-    with open(TODO_FILE, 'r+') as fd:
-        content = fd.read()
-        fd.seek(0)
-        fd.write(f'- [ ] {task} t:{date_str}\n{content}')
+    add_tasks([(task, date_str)])
+
+
+def parse_task_keys(line):
+    """Parse a todo line into (task, date) keys, with and without priority tag."""
+
+    match = TASK_RE.search(line)
+    if not match:
+        return []
+    match_dict = match.groupdict()
+    # Add task with and without priority tag to also get tasks where priority was added later.
+    task = ' '.join(f'{match_dict["task_head"]}{match_dict["task_tail"]}'.split())
+    keys = [(task, match_dict['date'])]
+    if match_dict['priority']:
+        keys.append((f'{match_dict["priority"]} {task}', match_dict['date']))
+    return keys
+
+
+def get_task_index():
+    """Build a set of (task, date) keys for all tasks in the todo file."""
+
+    task_index = set()
+    # Only lines with a date token can match TASK_RE. Scanned instead of going
+    # through todolist.load_tasks, which builds a Task for every line and the
+    # .todo.idx index although only the few dated lines are needed here.
+    for offset, line in todolist.scan_lines(TODO_FILE, b' t:'):
+        task_index.update(parse_task_keys(line.decode('utf-8', 'surrogateescape')))
+    return task_index
 
 
 def get_tasks(date_str):
     """Get tasks from todo file for a specific date."""
 
     tasks = []
-    with open(TODO_FILE) as fd:
-        for line in fd.read().splitlines():
-            match = re.search(TASK_RE, line)
-            if not match:
-                continue
-            match_dict = match.groupdict()
-            if match_dict['date'] == date_str:
-                # Add task with and without priority tag to also get tasks where priority was added later.
-                task = ' '.join(
-                    f'{match_dict["task_head"]}{match_dict["task_tail"]}'.split()
-                )
-
+    for offset, line in todolist.scan_lines(TODO_FILE, f' t:{date_str}'.encode()):
+        for task, task_date_str in parse_task_keys(
+            line.decode('utf-8', 'surrogateescape')
+        ):
+            if task_date_str == date_str:
                 tasks.append(task)
-                if match_dict['priority']:
-                    tasks.append(f'{match_dict["priority"]} {task}')
 
     return tasks
 
 
-if __name__ == '__main__':
+def main(argv=None):
+    global STATS
+
+    # Only imported here, a plain import of this module should stay cheap
+    import locale
+    import argparse
+
     parser = argparse.ArgumentParser(
         description=DESCRIPTION,
         formatter_class=argparse.RawTextHelpFormatter,
@@ -390,18 +1225,94 @@ if __name__ == '__main__':
         '--todo_dir',
         help='Specify TODO_DIR from command line',
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        '--locale',
+        help='Also accept weekday and month names of this locale, eg. de_DE.UTF-8',
+    )
+    parser.add_argument(
+        '--from',
+        dest='from_date',
+        type=datetime.date.fromisoformat,
+        help='List tasks occurring from this date (YYYY-MM-DD) instead of adding them',
+    )
+    parser.add_argument(
+        '--to',
+        dest='to_date',
+        type=datetime.date.fromisoformat,
+        help='List tasks occurring until this date (YYYY-MM-DD), defaults to --from',
+    )
+    parser.add_argument(
+        '--since',
+        type=datetime.date.fromisoformat,
+        help='Add tasks for every day since this date (YYYY-MM-DD), defaults to the day after the last run',
+    )
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const='-',
+        metavar='FILE',
+        help='Print timings of the phases and counters to stderr, or write them as JSON to FILE',
+    )
+    parser.add_argument(
+        '--cprofile',
+        metavar='FILE',
+        help='Write cProfile stats of the run to FILE, eg. for `python -m pstats FILE`',
+    )
+    args = parser.parse_args(argv)
+    if args.to_date and not args.from_date:
+        parser.error('--to requires --from')
+    if args.to_date and args.to_date < args.from_date:
+        parser.error('--from must not be after --to')
 
     log_level = logging.WARN
     if args.verbose == 1:
         log_level = logging.INFO
     if args.verbose >= 2:
         log_level = logging.DEBUG
+    logging.basicConfig(format='%(asctime)-15s %(levelname)s %(module)s: %(message)s')
     log.setLevel(log_level)
 
-    if args.todo_dir:
-        TODO_DIR = args.todo_dir
+    set_dirs(args.todo_dir or TODO_DIR)
+
+    if args.locale:
+        try:
+            add_locale_aliases(args.locale)
+        except locale.Error:
+            log.error('Unsupported locale %s', args.locale)
+            return 1
+
+    if args.profile:
+        STATS = Stats()
+    profiler = None
+    if args.cprofile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if args.from_date:
+        to_date = args.to_date or args.from_date
+        with STATS.phase('config'):
+            rules = get_rules(RECUR_FILE)
+        with STATS.phase('expand'):
+            occurrences = expand_rules(rules, args.from_date, to_date)
+        STATS.count('rules', len(rules))
+        STATS.count('occurrences', len(occurrences))
+        for date, task in occurrences:
+            print(f'{date:%F} {task}')
+    else:
+        add_today_tasks(RECUR_FILE, since=args.since)
+
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+    if args.profile == '-':
+        print('\n'.join(STATS.summary()), file=sys.stderr)
+    elif args.profile:
+        with open(args.profile, 'w') as fd:
+            json.dump(STATS.as_dict(), fd, indent=2)
+    return 0
 
-    set_dirs(TODO_DIR)
 
-    add_today_tasks(RECUR_FILE)
+if __name__ == '__main__':
+    sys.exit(main())
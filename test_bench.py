@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import pytest
+
+import bench
+import recur
+import todolist
+
+
+class TestBench:
+    @pytest.fixture
+    def todo_dir(self):
+        todo_dir = tempfile.mkdtemp()
+        yield todo_dir
+        shutil.rmtree(todo_dir)
+
+    def test_generate_todo_file(self, todo_dir):
+        todo_file = os.path.join(todo_dir, 'todo.md')
+        bench.generate_todo_file(todo_file, 1000)
+        tasks = todolist.load_tasks(todo_file)
+        assert 1000 <= sum(1 for line in open(todo_file)) <= 1003
+        assert {task.status for task in tasks} == {None, ' ', 'X'}
+        assert any(task.parent is not None for task in tasks)
+        assert any(task.contexts for task in tasks)
+        assert any(task.dates for task in tasks)
+
+    def test_generate_recur_file(self, todo_dir):
+        recur_file = os.path.join(todo_dir, 'recur.txt')
+        bench.generate_recur_file(recur_file, 130)
+        rules = recur.compile_rules(recur.get_dict(recur_file))
+        assert {rule.kind for rule in rules} == {
+            'single_day',
+            'multi_day',
+            'single_weekday',
+            'multi_weekday',
+            'month_day',
+            'month_day_year',
+            'weekday_range',
+            'nth_weekday',
+            'last_day',
+            'interval',
+        }
+        assert any(rule.warning_days for rule in rules)
+        assert any(rule.repeat_days for rule in rules)
+
+    def test_compare_results(self):
+        baseline = [
+            {'benchmark': 'recur', 'lines': 1000, 'seconds': 1.0},
+            {'benchmark': 'recur', 'lines': 10000, 'seconds': 1.0},
+        ]
+        results = [
+            {'benchmark': 'recur', 'lines': 1000, 'seconds': 1.4},
+            {'benchmark': 'recur', 'lines': 10000, 'seconds': 1.6},
+            {'benchmark': 'archive', 'lines': 1000, 'seconds': 9.0},
+        ]
+        baseline.append(
+            {'benchmark': 'mmap', 'megabytes': 1, 'seconds': 1.0, 'max_rss_kb': 2048}
+        )
+        results.append(
+            {'benchmark': 'mmap', 'megabytes': 1, 'seconds': 1.0, 'max_rss_kb': 4096}
+        )
+        assert bench.compare_results(results, baseline, 1.5) == [results[1]]
+        assert bench.format_result(results[0]) == 'recur lines=1000: 1.400000s'
+        assert bench.format_result(results[3]) == 'mmap megabytes=1: 1.000000s 4MB'
@@ -1,12 +1,51 @@
 #!/usr/bin/env python
 
+import os
+import sys
 import time
+import random
+import datetime
 import pytest
 import tempfile
 import shutil
+import subprocess
 
 import recur
 
+# Every kind of reminder and their edge cases around month ends and leap years
+REMINDERS = [
+    '15',
+    '31 22 11 15 33',
+    '15 x',
+    'Sat',
+    'Mon Wed Fri',
+    'Mon Invalid',
+    'Jan 15',
+    'Jan 24 +5',
+    'Jan 11 *5',
+    'Dec 31 *3',
+    'Jan 02 +4',
+    'Feb 29',
+    'Feb 29 +3',
+    'Feb 29 *400',
+    'Mar 01 +400',
+    'Mar 01 *3',
+    'Jan 01 2024 +3',
+    'Dec 31 2024 *3',
+    'invalid format',
+    'Mon-Fri',
+    'Sat-Mon',
+    '1st Mon',
+    '2nd Tue',
+    '5th Thu',
+    'last Fri',
+    'last Thu',
+    'last',
+    'every 2 weeks from 2023-01-02',
+    'every 10 days from 2024-02-20',
+    'every day from 2025-01-01',
+]
+
 
 class TestRecur:
     @pytest.fixture
@@ -90,6 +129,59 @@ class TestRecur:
         assert not is_rem
         assert not is_today
 
+    def test_weekday_aliases(self):
+        # Today is a Monday
+        day = time.strptime('2024 01 15', '%Y %m %d')
+
+        for alias in ['Mon', 'mon', 'MON', 'Monday', 'mo']:
+            assert recur.single_weekday(alias, day) == (True, True)
+        assert recur.single_weekday('Tuesday', day) == (True, False)
+        assert recur.single_weekday('Montag', day) == (False, False)
+
+        recur.add_aliases(weekdays={0: ['Montag']})
+        try:
+            assert recur.single_weekday('Montag', day) == (True, True)
+        finally:
+            del recur.WEEKDAYS['montag']
+
+    def test_weekday_month_aliases(self):
+        # Spanish "mar" (martes) is Tuesday and also March
+        recur.add_aliases(weekdays={1: ['mar']})
+        try:
+            assert recur.compile_reminder('Mar 15') == ('month_day', (3, 15), 0, 0)
+            assert recur.compile_reminder('Mar 15 2026 +3') == (
+                'month_day_year',
+                (2026, 3, 15),
+                3,
+                0,
+            )
+            assert recur.compile_reminder('mar') == ('single_weekday', (1,), 0, 0)
+            assert recur.compile_reminder('Mon mar') == (
+                'multi_weekday',
+                (0, 1),
+                0,
+                0,
+            )
+            tuesday = time.strptime('2024 01 16', '%Y %m %d')
+            assert not recur.parse_rem('Mar 15', tuesday)
+            assert recur.parse_rem('Mar 15', time.strptime('2024 03 15', '%Y %m %d'))
+            assert recur.parse_rem('mar', tuesday)
+        finally:
+            del recur.WEEKDAYS['mar']
+
+    def test_parse_month_day(self):
+        assert recur.parse_month_day('Nov 22') == (11, 22)
+        assert recur.parse_month_day('september 1') == (9, 1)
+        assert recur.parse_month_day('Sept 01') == (9, 1)
+        assert recur.parse_month_day('Feb 29') == (2, 29)
+        assert recur.parse_month_day('Feb 29', 2023) is None
+        assert recur.parse_month_day('Feb 30') is None
+        assert recur.parse_month_day('Nov 022') is None
+        assert recur.parse_month_day('Mon 22') is None
+        assert recur.parse_month_day_year('Nov 22 2007') == (2007, 11, 22)
+        assert recur.parse_month_day_year('Feb 29 2023') is None
+        assert recur.parse_month_day_year('Nov 22 07') is None
+
     def test_multi_weekday(self):
         # Today is a Monday
         day = time.strptime('2024 01 15', '%Y %m %d')
@@ -194,16 +286,250 @@ class TestRecur:
             '{Jun 01}': ['plan summer vacation'],
         }
 
+    def test_compile_reminder(self):
+        assert recur.compile_reminder('15') == ('single_day', (15,), 0, 0)
+        assert recur.compile_reminder('1 15 x') == ('multi_day', (1, 15), 0, 0)
+        assert recur.compile_reminder('Mon') == ('single_weekday', (0,), 0, 0)
+        assert recur.compile_reminder('Mon Wed') == ('multi_weekday', (0, 2), 0, 0)
+        assert recur.compile_reminder('Nov 27 *5') == ('month_day', (11, 27), 0, 5)
+        assert recur.compile_reminder('Feb 29 +3') == ('month_day', (2, 29), 3, 0)
+        assert recur.compile_reminder('Nov 22 2007') == (
+            'month_day_year',
+            (2007, 11, 22),
+            0,
+            0,
+        )
+        assert recur.compile_reminder('Fri-Mon') == (
+            'weekday_range',
+            (4, 5, 6, 0),
+            0,
+            0,
+        )
+        assert recur.compile_reminder('2nd tue') == ('nth_weekday', (2, 1), 0, 0)
+        assert recur.compile_reminder('last Fri') == ('nth_weekday', (-1, 4), 0, 0)
+        assert recur.compile_reminder('last') == ('last_day', (), 0, 0)
+        assert recur.compile_reminder('every 2 weeks from 2026-01-05') == (
+            'interval',
+            (datetime.date(2026, 1, 5).toordinal(), 14),
+            0,
+            0,
+        )
+        assert recur.compile_reminder('every week from 2026-02-30')[0] == 'invalid'
+        assert recur.compile_reminder('6th Mon')[0] == 'invalid'
+        assert recur.compile_reminder('Mon-Foo')[0] == 'invalid'
+        assert recur.compile_reminder('invalid format') == ('invalid', (), 0, 0)
+
+    def test_rule_matches(self):
+        rules = recur.compile_rules({f'{{{r}}}': ['task'] for r in REMINDERS})
+        day = datetime.date(2023, 1, 1)
+        while day < datetime.date(2025, 3, 15):
+            today = day.timetuple()
+            for reminder, rule in zip(REMINDERS, rules):
+                assert recur.rule_matches(rule, today) == bool(
+                    recur.parse_rem(reminder, today)
+                ), f'{reminder} on {day}'
+            day += datetime.timedelta(days=1)
+
+    def test_rules_on(self):
+        rules = recur.compile_rules({f'{{{r}}}': ['task'] for r in REMINDERS})
+        index = recur.index_rules(rules)
+        positions = lambda *reminders: [REMINDERS.index(r) for r in reminders]
+        assert index['invalid'] == positions('invalid format')
+        assert index['always'] == positions(
+            'Feb 29 *400',
+            'Mar 01 +400',
+            'every 10 days from 2024-02-20',
+            'every day from 2025-01-01',
+        )
+        assert positions('every 2 weeks from 2023-01-02')[0] in index['weekday 0']
+        assert index['date 3 2'] == positions('Mar 01 *3')
+
+        # The buckets are the same for every year, eg. now and around 2100, which
+        # is not a leap year
+        for start_date, end_date in [
+            (datetime.date(2023, 1, 1), datetime.date(2025, 3, 15)),
+            (datetime.date(2026, 1, 1), datetime.date(2028, 3, 15)),
+            (datetime.date(2099, 12, 1), datetime.date(2101, 3, 15)),
+        ]:
+            day = start_date
+            while day < end_date:
+                today = day.timetuple()
+                assert recur.rules_on(rules, index, day) == [
+                    rule for rule in rules if recur.rule_matches(rule, today)
+                ], str(day)
+                day += datetime.timedelta(days=1)
+
+    def test_expand_rules(self):
+        rules = recur.compile_rules({f'{{{r}}}': [r] for r in REMINDERS})
+        start_date = datetime.date(2023, 1, 1)
+        end_date = datetime.date(2025, 3, 15)
+
+        expected = []
+        day = start_date
+        while day <= end_date:
+            for reminder in REMINDERS:
+                if recur.parse_rem(reminder, day.timetuple()):
+                    expected.append((day, reminder))
+            day += datetime.timedelta(days=1)
+
+        occurrences = recur.expand_rules(rules, start_date, end_date)
+        assert sorted(occurrences) == sorted(expected)
+
+    def test_extended_rules(self):
+        reminders = {
+            'last': ['last'],
+            'last Thu': ['last Thu'],
+            '5th Thu': ['5th Thu'],
+            'every 3 weeks from 2024-02-01': ['every 3 weeks'],
+            'every 29 days from 2024-01-31': ['every 29 days'],
+        }
+        rules = recur.compile_rules({f'{{{r}}}': t for r, t in reminders.items()})
+        occurrences = recur.expand_rules(
+            rules, datetime.date(2024, 1, 30), datetime.date(2024, 3, 31)
+        )
+        assert occurrences == [
+            (datetime.date(2024, 1, 31), 'last'),
+            (datetime.date(2024, 1, 31), 'every 29 days'),
+            (datetime.date(2024, 2, 1), 'every 3 weeks'),
+            (datetime.date(2024, 2, 22), 'every 3 weeks'),
+            (datetime.date(2024, 2, 29), 'last'),
+            (datetime.date(2024, 2, 29), 'last Thu'),
+            (datetime.date(2024, 2, 29), '5th Thu'),
+            (datetime.date(2024, 2, 29), 'every 29 days'),
+            (datetime.date(2024, 3, 14), 'every 3 weeks'),
+            (datetime.date(2024, 3, 28), 'last Thu'),
+            (datetime.date(2024, 3, 29), 'every 29 days'),
+            (datetime.date(2024, 3, 31), 'last'),
+        ]
+        assert recur.expand_rules(
+            rules, datetime.date(2023, 2, 1), datetime.date(2023, 2, 28)
+        ) == [
+            (datetime.date(2023, 2, 23), 'last Thu'),
+            (datetime.date(2023, 2, 28), 'last'),
+        ]
+
+    def test_expand_rules_order(self, recur_config_file):
+        rules = recur.get_rules(recur.RECUR_FILE)
+        assert recur.expand_rules(
+            rules, datetime.date(2021, 11, 28), datetime.date(2021, 11, 29)
+        ) == [
+            (datetime.date(2021, 11, 29), 'backup filesystem'),
+            (datetime.date(2021, 11, 29), 'pay rent check every month on the 29th'),
+            (
+                datetime.date(2021, 11, 29),
+                ':email: birthday card every year to someone',
+            ),
+        ]
+
+    def test_main_range_errors(self, todo_file, capsys):
+        with open(recur.TODO_FILE) as fh:
+            content = fh.read()
+        todo_dir = os.path.dirname(recur.TODO_FILE)
+        for args in (
+            ['--to', '2022-01-31'],
+            ['--from', '2022-02-01', '--to', '2022-01-31'],
+        ):
+            with pytest.raises(SystemExit) as excinfo:
+                recur.main(['-d', todo_dir, *args])
+            assert excinfo.value.code == 2
+        assert '--from must not be after --to' in capsys.readouterr().err
+        with open(recur.TODO_FILE) as fh:
+            assert fh.read() == content
+
+    def test_get_rules_cache(self, recur_config_file, monkeypatch):
+        rules = recur.get_rules(recur.RECUR_FILE)
+        assert [rule.kind for rule in rules] == [
+            'multi_weekday',
+            'single_day',
+            'month_day',
+            'month_day',
+        ]
+        assert os.path.isfile(recur.get_rules_cache_file(recur.RECUR_FILE))
+
+        def fail(reminders_config):
+            raise AssertionError('rules should be loaded from cache')
+
+        monkeypatch.setattr(recur, 'compile_rules', fail)
+        assert recur.get_rules(recur.RECUR_FILE) == rules
+
+        monkeypatch.undo()
+        with open(recur.RECUR_FILE, 'a') as fh:
+            fh.write('{Tue} water plants\n')
+        assert len(recur.get_rules(recur.RECUR_FILE)) == 5
+
     def test_task_exists(self, todo_file):
         assert not recur.task_exists('backup filesystem', '2022-01-01')
         assert recur.task_exists('backup filesystem', '2021-11-29')
         assert recur.task_exists('plan summer vacation', '2024-06-01')
 
+    def test_task_exists_with_index(self, todo_file):
+        with open(recur.TODO_FILE, 'a') as fh:
+            fh.write('- [ ] B  water   plants t:2021-11-29\n')
+        task_index = recur.get_task_index()
+        assert recur.task_exists('backup filesystem', '2021-11-29', task_index)
+        assert not recur.task_exists('backup filesystem', '2022-01-01', task_index)
+        assert recur.task_exists('water plants', '2021-11-29', task_index)
+        assert recur.task_exists('B water plants', '2021-11-29', task_index)
+
+    def test_get_task_index(self, todo_file):
+        assert recur.get_task_index() == {
+            ('backup filesystem', '2021-11-29'),
+            ('pay rent check every month on the 29th', '2021-11-29'),
+            (':email: birthday card every year to someone', '2021-11-29'),
+            ('plan summer vacation', '2024-06-01'),
+        }
+
     def test_add_task(self, todo_file):
         recur.add_task('take out the trash', '2022-01-01')
         with open(recur.TODO_FILE) as fh:
             assert fh.read() == '- [ ] take out the trash t:2022-01-01\n' + todo_file
 
+    def test_add_tasks(self, todo_file):
+        recur.add_tasks(
+            [('take out the trash', '2022-01-01'), ('water plants', '2022-01-02')]
+        )
+        with open(recur.TODO_FILE) as fh:
+            assert fh.read() == (
+                '- [ ] water plants t:2022-01-02\n'
+                '- [ ] take out the trash t:2022-01-01\n' + todo_file
+            )
+        assert sorted(os.listdir(os.path.dirname(recur.TODO_FILE))) == [
+            '.todo.lock',
+            'todo.md',
+        ]
+
+    def test_add_tasks_concurrently(self, todo_file):
+        code = (
+            'import sys, recur\n'
+            'recur.set_dirs(sys.argv[1])\n'
+            'for i in range(25):\n'
+            '    recur.add_task(f"task {sys.argv[2]}.{i}", "2022-01-01")\n'
+        )
+        todo_dir = os.path.dirname(recur.TODO_FILE)
+        writers = [
+            subprocess.Popen(
+                [sys.executable, '-c', code, todo_dir, str(writer)],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+            for writer in range(4)
+        ]
+        assert [writer.wait() for writer in writers] == [0, 0, 0, 0]
+        tasks = recur.get_tasks('2022-01-01')
+        assert sorted(tasks) == sorted(
+            f'task {writer}.{i}' for writer in range(4) for i in range(25)
+        )
+
+    def test_write_atomic_conflict(self, todo_file, monkeypatch):
+        signatures = iter(range(100))
+        monkeypatch.setattr(
+            recur.todolist, 'get_signature', lambda path: next(signatures)
+        )
+        with pytest.raises(recur.todolist.WriteConflict):
+            recur.add_task('take out the trash', '2022-01-01')
+        with open(recur.TODO_FILE) as fh:
+            assert fh.read() == todo_file
+        assert next(signatures) == 2 * recur.todolist.WRITE_ATTEMPTS
+
     def test_get_tasks(self, todo_file):
         assert recur.get_tasks('Mon') == []
         assert recur.get_tasks('2021-11-29') == [
@@ -225,6 +551,80 @@ class TestRecur:
 
         assert todos[0] == time.strftime('- [ ] pick up milk t:%F\n', now)
 
+    def test_add_today_tasks_dedup(self, todo_file):
+        now = time.localtime()
+        task = time.strftime('{%b %d} pick up milk\n', now)
+        with open(recur.RECUR_FILE, 'w+') as fh:
+            fh.write(task + task)
+
+        recur.add_today_tasks(recur.RECUR_FILE)
+        recur.add_today_tasks(recur.RECUR_FILE)
+
+        with open(recur.TODO_FILE) as fh:
+            todos = fh.readlines()
+
+        assert todos.count(time.strftime('- [ ] pick up milk t:%F\n', now)) == 1
+
+    def test_add_today_tasks_profile(self, todo_file, monkeypatch):
+        stats = recur.Stats()
+        monkeypatch.setattr(recur, 'STATS', stats)
+        today = datetime.date.today()
+        with open(recur.RECUR_FILE, 'w+') as fh:
+            fh.write(f'{{{today:%b %d}}} pick up milk\n{{{today:%a}}} water plants\n')
+            fh.write(f'{{{today:%b %d} {today.year - 1}}} missed\n')
+            fh.write('{Nov 22 xyz} invalid\n')
+
+        recur.add_today_tasks(recur.RECUR_FILE, since=today)
+        recur.add_today_tasks(recur.RECUR_FILE, since=today)
+
+        assert stats.counters == {
+            'rules': 8,
+            'rules_evaluated': 6,
+            'rules_matched': 4,
+            'tasks_deduped': 2,
+            'tasks_added': 2,
+        }
+        assert stats.as_dict()['phases'].keys() == {
+            'config',
+            'scan',
+            'rules.month_day',
+            'rules.month_day_year',
+            'rules.single_weekday',
+            'write',
+        }
+        assert stats.phases['rules.month_day'][0] == 2
+        assert stats.phases['scan'][0] == 2
+        assert stats.summary()[0].split() == ['phase', 'calls', 'seconds']
+
+    def test_add_today_tasks_catch_up(self, todo_file):
+        today = datetime.date.today()
+        with open(recur.RECUR_FILE, 'w+') as fh:
+            fh.write('{%s} water plants\n' % ' '.join(str(d) for d in range(1, 32)))
+        with open(recur.LAST_RUN_FILE, 'w+') as fh:
+            fh.write(f'{today - datetime.timedelta(days=3):%F}\n')
+
+        recur.add_today_tasks(recur.RECUR_FILE)
+
+        with open(recur.TODO_FILE) as fh:
+            todos = fh.readlines()
+        assert todos[:3] == [
+            f'- [ ] water plants t:{today - datetime.timedelta(days=i):%F}\n'
+            for i in range(3)
+        ]
+        assert todos[3:] == todo_file.splitlines(True)
+        assert recur.get_last_run() == today
+
+        recur.add_today_tasks(
+            recur.RECUR_FILE, since=today - datetime.timedelta(days=4)
+        )
+        with open(recur.TODO_FILE) as fh:
+            todos = fh.readlines()
+        assert todos[:2] == [
+            f'- [ ] water plants t:{today - datetime.timedelta(days=i):%F}\n'
+            for i in (3, 4)
+        ]
+        assert len(todos) == len(todo_file.splitlines()) + 5
+
     def test_month_day(self):
         # Test cases for month_day function
         today = time.strptime('2024 01 15', '%Y %m %d')
@@ -281,6 +681,78 @@ class TestRecur:
             False,
         )
 
+    def test_month_day_leap_day(self):
+        # Feb 29 events only occur in leap years, but their windows cross into other years
+        today = time.strptime('2023 02 28', '%Y %m %d')
+        assert recur.month_day('Feb 29', today) == (True, False)
+        today = time.strptime('2025 01 10', '%Y %m %d')
+        assert recur.month_day('Feb 29', today, repeat_days=400) == (True, True)
+        assert recur.month_day('Feb 29', today, repeat_days=300) == (True, False)
+        today = time.strptime('2023 12 31', '%Y %m %d')
+        assert recur.month_day('Feb 29', today, warning_days=61) == (True, True)
+        assert recur.month_day('Feb 29', today, warning_days=60) == (True, False)
+        today = time.strptime('2100 02 28', '%Y %m %d')
+        assert recur.month_day('Feb 29', today, repeat_days=3) == (True, False)
+
+    def test_month_day_window_property(self):
+        def loop_month_day(month, day, current_date, warning_days, repeat_days):
+            # Reference implementation: walk the whole warning and repeat windows
+            def is_event(date):
+                return (date.month, date.day) == (month, day)
+
+            for i in range(1, warning_days):
+                if is_event(current_date + datetime.timedelta(days=i)):
+                    return True
+            for i in range(1, repeat_days):
+                if is_event(current_date - datetime.timedelta(days=i)):
+                    return True
+            return is_event(current_date)
+
+        def loop_month_day_year(event_date, current_date, warning_days, repeat_days):
+            for i in range(1, warning_days):
+                if event_date - datetime.timedelta(days=i) == current_date:
+                    return True
+            for i in range(1, repeat_days):
+                if event_date + datetime.timedelta(days=i) == current_date:
+                    return True
+            return event_date == current_date
+
+        rand = random.Random(42)
+        first_day = datetime.date(1999, 1, 1).toordinal()
+        last_day = datetime.date(2105, 12, 31).toordinal()
+        for _ in range(3000):
+            current_date = datetime.date.fromordinal(rand.randint(first_day, last_day))
+            event_date = datetime.date.fromordinal(
+                current_date.toordinal() + rand.randint(-500, 500)
+            )
+            if rand.random() < 0.2:
+                event_date = datetime.date(rand.choice([2000, 2024, 2104]), 2, 29)
+            warning_days = rand.choice([0, 1, 2, rand.randint(0, 800)])
+            repeat_days = rand.choice([0, 1, 2, rand.randint(0, 800)])
+            today = current_date.timetuple()
+
+            assert recur.month_day_match(
+                event_date.month,
+                event_date.day,
+                today,
+                warning_days=warning_days,
+                repeat_days=repeat_days,
+            ) == loop_month_day(
+                event_date.month,
+                event_date.day,
+                current_date,
+                warning_days,
+                repeat_days,
+            ), f'{event_date} +{warning_days} *{repeat_days} on {current_date}'
+            assert recur.month_day_year_match(
+                event_date,
+                today,
+                warning_days=warning_days,
+                repeat_days=repeat_days,
+            ) == loop_month_day_year(
+                event_date, current_date, warning_days, repeat_days
+            ), f'{event_date} +{warning_days} *{repeat_days} on {current_date}'
+
     def test_month_day_year(self):
         # Test cases for month_day_year function
         today = time.strptime('2024 01 15', '%Y %m %d')
@@ -343,3 +815,19 @@ class TestRecur:
             True,
             False,
         )
+
+    def test_import(self):
+        # Importing recur must neither parse arguments nor configure logging
+        result = subprocess.run(
+            [
+                sys.executable,
+                '-c',
+                'import sys, logging, recur; '
+                'print("argparse" in sys.modules, logging.getLogger().handlers)',
+            ],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert result.stdout == 'False []\n'
@@ -0,0 +1,802 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import pytest
+import shutil
+import threading
+import datetime
+import functools
+import tempfile
+import subprocess
+
+import todolist
+import todoserver
+import todosearch
+
+# Modules only some actions need, a listing call must not import them.
+DEFERRED_MODULES = [
+    'argparse',
+    'logging',
+    'gzip',
+    'shutil',
+    'socket',
+    'tempfile',
+    'socketserver',
+    'sqlite3',
+    'concurrent.futures',
+]
+
+
+def imported_modules(module):
+    """Get the modules imported by a module, from a `python -X importtime` report."""
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return [
+        line.rsplit('|', 1)[1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith('import time:')
+    ]
+
+
+class TestTodoList:
+    @pytest.fixture
+    def todo_file(self):
+        todo_dir = tempfile.mkdtemp()
+        todo_file = os.path.join(todo_dir, 'todo.md')
+        content = '\n'.join(
+            [
+                "- [X] implement 'archive' command :coding:",
+                '- [ ] add some more info to the README :docs:',
+                '    - [ ] add an intro :intro:',
+                '    - [ ] add some quick examples',
+                '- [ ] commit and push t:2022-05-01',
+                '- [ ] buy milk :home: t:2022-05-02 today',
+                '- [ ] Call mom :home:',
+                '# Notes :notes:',
+                '',
+            ]
+        )
+        with open(todo_file, 'w+') as fh:
+            fh.write(content)
+        yield todo_file
+        shutil.rmtree(todo_dir)
+
+    def test_parse(self, todo_file):
+        todo = todolist.parse(todo_file)
+        assert todo.prefix == 'TODO'
+        assert len(todo.items) == 5
+        assert todo.contexts == [
+            ':coding:',
+            ':docs:',
+            ':intro:',
+            ':home:',
+            ':home:',
+            ':notes:',
+        ]
+        assert todo.dates == ['t:2022-05-01', 't:2022-05-02']
+
+    def test_parse_lines(self, todo_file):
+        with open(todo_file, 'rb') as fh:
+            tasks = todolist.parse_lines(fh.read())
+        assert tasks[0] == todolist.Task(
+            0,
+            0,
+            'X',
+            "- [X] implement 'archive' command :coding:",
+            [':coding:'],
+            [],
+            None,
+        )
+        assert [task.offset for task in tasks[1:3]] == [43, 89]
+        assert tasks[2].indent == 4
+        assert tasks[7] == todolist.Task(
+            252, 0, None, '# Notes :notes:', [':notes:'], [], None
+        )
+        tasks = todolist.link_parents(tasks)
+        assert [task.parent for task in tasks] == [
+            None,
+            None,
+            1,
+            1,
+            None,
+            None,
+            None,
+            None,
+        ]
+
+    def test_load_tasks_index(self, todo_file, monkeypatch):
+        tasks = todolist.load_tasks(todo_file)
+        assert os.path.isfile(os.path.join(os.path.dirname(todo_file), '.todo.idx'))
+
+        parsed = []
+        parse_lines = todolist.parse_lines
+
+        def track_parse_lines(content, offset=0):
+            parsed.append(content)
+            return parse_lines(content, offset)
+
+        monkeypatch.setattr(todolist, 'parse_lines', track_parse_lines)
+        assert todolist.load_tasks(todo_file) == tasks
+        assert parsed == []
+
+        with open(todo_file, 'a') as fh:
+            fh.write('    - [ ] appended :new:\n')
+        appended = todolist.load_tasks(todo_file)
+        assert parsed == [b'    - [ ] appended :new:\n']
+        assert appended[-1].parent == len(appended) - 3
+        # Only the appended row is added to the index, twice is the same as once
+        index_file = todolist.get_sidecar_file(todo_file, 'idx')
+        with open(index_file) as fh:
+            lines = fh.readlines()
+        assert len(lines) == 2
+        with open(index_file, 'a') as fh:
+            fh.write(lines[1])
+        assert todolist.load_tasks(todo_file) == appended
+        assert len(parsed) == 1
+
+        monkeypatch.setattr(todolist, 'INDEX_APPENDS_MAX', 2)
+        with open(todo_file, 'a') as fh:
+            fh.write('- [ ] appended again\n')
+        todolist.load_tasks(todo_file)
+        with open(index_file) as fh:
+            assert len(fh.readlines()) == 1
+
+        parsed.clear()
+        with open(todo_file, 'r+') as fh:
+            content = fh.read()
+            fh.seek(0)
+            fh.write(f'- [ ] prepended t:2022-01-01\n    - [ ] sub\n{content}')
+        tasks = todolist.load_tasks(todo_file)
+        assert parsed == [b'- [ ] prepended t:2022-01-01\n    - [ ] sub']
+
+        with open(todo_file, 'rb') as fh:
+            assert tasks == todolist.link_parents(parse_lines(fh.read()))
+
+        parsed.clear()
+        with open(todo_file, 'w') as fh:
+            fh.write('- [ ] rewritten\n')
+        assert [task.text for task in todolist.load_tasks(todo_file)] == [
+            '- [ ] rewritten'
+        ]
+        assert parsed == [b'- [ ] rewritten\n']
+
+    def test_grep_re(self):
+        assert todolist.grep_re('milk').search('Buy MILK')
+        assert todolist.grep_re('a|b').search('a|b')
+        assert not todolist.grep_re('a|b').search('a')
+        assert todolist.grep_re(r'a\|b').search('b')
+        assert todolist.grep_re('c++').search('c++')
+        assert todolist.grep_re(':home\\b').search('x :home: y')
+        assert not todolist.grep_re(':home\\b').search('x :homework:')
+        assert todolist.grep_re('[[:digit:]]-').search('t:2022-05-01')
+        assert todolist.grep_re('^- \\[x\\]').search('- [X] done')
+        assert todolist.grep_re('*').search('a*b')
+        assert not todolist.grep_re('m[^i]lk').search('buy milk')
+        assert todolist.grep_re('m[^i]lk').search('buy malk')
+        assert not todolist.grep_re('b[^0-9]').search('b1')
+        assert todolist.grep_re('[^[:digit:]]').search('1a')
+        assert not todolist.grep_re('[^[:digit:]]').search('12')
+        assert todolist.grep_re('a[]]b').search('a]b')
+        assert todolist.grep_re('a[^]]b').search('a-b')
+        assert not todolist.grep_re('a[^]]b').search('a]b')
+        assert todolist.grep_re('[[:punct:]]').search('a[b')
+        assert todolist.grep_re('[[:punct:]]').search('a]b')
+        assert todolist.grep_re('[[:punct:]]').search('a\\b')
+        assert not todolist.grep_re('[[:punct:]]').search('ab c')
+        assert todolist.grep_re('[a\\]').search('\\')
+        assert todolist.grep_re('[x^]').search('^')
+        with pytest.raises(todolist.re.error):
+            todolist.grep_re('[abc')
+
+    def test_list_items(self, todo_file):
+        todo = todolist.parse(todo_file)
+        assert todolist.list_items(todo, []) == [
+            '- [ ] add some more info to the README :docs:',
+            '- [ ] buy milk :home: t:2022-05-02 today',
+            '- [ ] Call mom :home:',
+            '- [ ] commit and push t:2022-05-01',
+            "- [X] implement 'archive' command :coding:",
+        ]
+        assert todolist.list_items(todo, ['home', '-milk']) == [
+            '- [ ] Call mom :home:'
+        ]
+        assert todolist.list_items(todo, ['nothing'], verbose=1) == [
+            '---',
+            'TODO: 0 of 5 tasks shown',
+        ]
+
+    def test_context_view(self, todo_file):
+        todo = todolist.parse(todo_file)
+        assert todolist.context_view(todo, ['-milk']) == [
+            '# Contexts',
+            '',
+            '## coding',
+            "- [X] implement 'archive' command :coding:",
+            '',
+            '## docs',
+            '- [ ] add some more info to the README :docs:',
+            '',
+            '## home',
+            '- [ ] Call mom :home:',
+            '',
+        ]
+
+    def test_context_query(self, todo_file):
+        with open(todo_file, 'a') as fh:
+            fh.write('- [ ] fix the bike :home:errands:\n- [ ] buy stamps :errands:\n')
+        todo = todolist.parse(todo_file)
+        assert todolist.context_view(todo, ['--all', ':home:errands:']) == [
+            '# Contexts',
+            '',
+            '## errands',
+            '- [ ] fix the bike :home:errands:',
+            '',
+            '## home',
+            '- [ ] fix the bike :home:errands:',
+            '',
+        ]
+        assert todolist.context_view(
+            todo, ['--any', 'errands,docs', '--none', 'home', '-README']
+        ) == ['# Contexts', '', '## errands', '- [ ] buy stamps :errands:', '']
+        index = todolist.context_index(todo.item_contexts)
+        assert index['errands'] == [5, 6]
+        terms = ['--none', 'home,coding,docs,errands', 'mom']
+        assert todolist.context_query(index, len(todo.items), terms) == {2}
+        assert terms == ['mom']
+        with pytest.raises(ValueError):
+            todolist.context_query(index, len(todo.items), ['--all', ','])
+
+    def test_date_view(self, todo_file):
+        todo = todolist.parse(todo_file)
+        today = datetime.date(2022, 5, 1)
+        assert todolist.date_view(todo, 'date', [], today=today) == [
+            '# Dates',
+            '',
+            '## 2022-05-01',
+            '- [ ] commit and push ',
+            '',
+            '## 2022-05-02',
+            '- [ ] buy milk :home: today',
+            '',
+        ]
+        assert todolist.date_view(todo, 'past', [], today=today) == [
+            '# Dates',
+            '',
+            '## 2022-05-01',
+            '- [ ] commit and push ',
+            '',
+        ]
+        assert todolist.date_view(todo, 'tomorrow', ['milk'], today=today) == [
+            '# Dates',
+            '',
+            '## 2022-05-02',
+            '- [ ] buy milk :home: today',
+            '',
+        ]
+        assert todolist.date_view(todo, 'yesterday', [], today=today) == [
+            '# Dates',
+            '',
+            '## 2022-05-01',
+            '- [ ] commit and push ',
+            '',
+        ]
+        assert todolist.date_view(todo, 'nodate', ['-README'], today=today) == [
+            '# Dates',
+            '',
+            '## Items without date',
+            '- [ ] Call mom :home:',
+            "- [X] implement 'archive' command :coding:",
+        ]
+
+    def test_date_check(self):
+        today = datetime.date(2022, 5, 1)
+        assert todolist.date_check('future', today, '2022-05-01')
+        assert not todolist.date_check('future', today, '2022-04-30')
+        assert todolist.date_check('past', today, 'invalid')
+        assert todolist.date_check('today', today, '2022-05-01')
+        assert not todolist.date_check('today', today, 'today')
+        assert not todolist.date_check('tomorrow', today, 'tomorrow')
+        assert not todolist.date_check('nodate', today, '2022-05-01')
+
+    def test_date_range(self):
+        today = datetime.date(2022, 5, 1)
+        day = today.toordinal()
+        assert todolist.date_range('past', today) == (-todolist.INFINITY, day)
+        assert todolist.date_range('yesterday', today) == (day - 1, day)
+        terms = ['--from', '2022-04', 'milk', '--to', '2022-06']
+        assert todolist.date_range('future', today, terms) == (day, day + 60.5)
+        assert terms == ['milk']
+        assert todolist.date_range('date', today, ['--to', '2022-02']) == (
+            -todolist.INFINITY,
+            datetime.date(2022, 2, 28).toordinal() + 0.5,
+        )
+        with pytest.raises(ValueError):
+            todolist.date_range('date', today, ['--from', '2022-02-30'])
+        terms = ['--from', '2022-04', 'milk']
+        assert todolist.date_range('nodate', today, terms) == (
+            todolist.INFINITY,
+            -todolist.INFINITY,
+        )
+        assert terms == ['milk']
+        with pytest.raises(ValueError):
+            todolist.date_range('nodate', today, ['--to', '2022-13'])
+
+    def test_date_view_range(self, todo_file):
+        with open(todo_file, 'a') as fh:
+            fh.write(
+                '- [ ] pay rent t:2022-06-01\n'
+                '- [ ] water plants t:2022-05-1 t:tomorrow\n'
+                '- [ ] odd date t:2022.05.02\n'
+                '- [ ] tenth t:2022-05-10\n'
+            )
+        todo = todolist.parse(todo_file)
+        today = datetime.date(2022, 5, 1)
+        terms = ['--from', '2022-05-02', '--to', '2022-05-09']
+        assert todolist.date_view(todo, 'date', terms, today=today) == [
+            '# Dates',
+            '',
+            '## 2022-05-02',
+            '- [ ] buy milk :home: today',
+            '',
+            '## tomorrow',
+            '- [ ] water plants  tomorrow',
+            '',
+        ]
+        # Like grep, t:2022-05-1 also matches t:2022-05-10 and . any character
+        assert todolist.date_view(todo, 'past', [], today=today) == [
+            '# Dates',
+            '',
+            '## 2022-05-01',
+            '- [ ] commit and push ',
+            '',
+            '## 2022-05-1',
+            '- [ ] tenth ',
+            '- [ ] water plants  tomorrow',
+            '',
+            '## 2022.05.02',
+            '- [ ] buy milk :home: today',
+            '- [ ] odd date .05.02',
+            '',
+        ]
+        groups = todolist.group_by_date(todo.items, ['2022-05-0', '2022.05.02'])
+        assert groups == {
+            '2022-05-0': [
+                '- [ ] commit and push t:2022-05-01',
+                '- [ ] buy milk :home: t:2022-05-02 today',
+            ],
+            '2022.05.02': [
+                '- [ ] buy milk :home: t:2022-05-02 today',
+                '- [ ] odd date t:2022.05.02',
+            ],
+        }
+
+    def test_archive(self, todo_file):
+        with open(todo_file, 'w') as fh:
+            fh.write(
+                '\n'.join(
+                    [
+                        '- [X] done :ctx:',
+                        '    - [ ] sub of done',
+                        '',
+                        '- [ ] open task',
+                        '    - [X] done subtask stays',
+                        '- [ ] open task',
+                        '- [x] done two',
+                        '- [✓] done three',
+                        '- [ ] open task',
+                        '',
+                    ]
+                )
+            )
+        done_file = os.path.join(os.path.dirname(todo_file), 'done.md')
+        with open(done_file, 'w') as fh:
+            fh.write('- [X] archived before\n')
+
+        archived = todolist.archive(todo_file, done_file, stamp=True)
+
+        assert archived == [
+            '- [X] done :ctx:',
+            '    - [ ] sub of done',
+            '- [x] done two',
+            '- [✓] done three',
+        ]
+        with open(todo_file) as fh:
+            assert fh.read() == (
+                '- [ ] open task\n'
+                '    - [X] done subtask stays\n'
+                '- [ ] open task\n'
+                '- [ ] open task\n'
+            )
+        with open(done_file) as fh:
+            assert fh.read() == '\n'.join(
+                [
+                    '- [X] archived before',
+                    f'## {datetime.date.today():%F}',
+                    *archived,
+                    '',
+                ]
+            )
+        assert sorted(os.listdir(os.path.dirname(todo_file))) == [
+            '.todo.lock',
+            'done.md',
+            'todo.md',
+            'todo.md.bak',
+        ]
+
+        assert todolist.archive(todo_file, done_file) == []
+
+    def test_archive_shards(self, todo_file):
+        with open(todo_file, 'w') as fh:
+            fh.write(
+                '\n'.join(
+                    [
+                        '- [X] file taxes t:2025-04-15',
+                        '    - [ ] find receipts',
+                        '- [ ] open task t:2025-04-01',
+                        '- [x] no date :home:',
+                        '- [X] invalid date t:2025-13-01',
+                        '- [X] pay rent t:2025-04-01',
+                        '',
+                    ]
+                )
+            )
+        todo_dir = os.path.dirname(todo_file)
+        done_dir = os.path.join(todo_dir, 'done')
+        today = datetime.date.today()
+
+        todolist.archive(todo_file, None, done_dir=done_dir)
+
+        with open(os.path.join(done_dir, '2025-04.md')) as fh:
+            assert fh.read() == (
+                '- [X] file taxes t:2025-04-15\n'
+                '    - [ ] find receipts\n'
+                '- [X] pay rent t:2025-04-01\n'
+            )
+        with open(os.path.join(done_dir, f'{today:%Y-%m}.md')) as fh:
+            assert fh.read() == (
+                '- [x] no date :home:\n- [X] invalid date t:2025-13-01\n'
+            )
+        assert todolist.read_manifest(done_dir) == {
+            '2025-04': {
+                'file': '2025-04.md',
+                'first': '2025-04-01',
+                'last': '2025-04-15',
+                'count': 2,
+            },
+            f'{today:%Y-%m}': {
+                'file': f'{today:%Y-%m}.md',
+                'first': f'{today:%F}',
+                'last': f'{today:%F}',
+                'count': 2,
+            },
+        }
+
+        assert todolist.compress_shards(done_dir, f'{today:%Y-%m}') == ['2025-04.md']
+        assert sorted(os.listdir(done_dir)) == [
+            '2025-04.md.gz',
+            f'{today:%Y-%m}.md',
+            'manifest.json',
+        ]
+        with open(todo_file, 'a') as fh:
+            fh.write('- [X] late receipt t:2025-04-20\n')
+        todolist.archive(todo_file, None, done_dir=done_dir)
+        shard = todolist.read_manifest(done_dir)['2025-04']
+        assert shard == {
+            'file': '2025-04.md.gz',
+            'first': '2025-04-01',
+            'last': '2025-04-20',
+            'count': 3,
+        }
+
+        run = functools.partial(
+            todolist.run, todo_file=todo_file, done_file=None, done_dir=done_dir
+        )
+        assert run('done', ['--from', '2025-04', '--to', '2025-04']) == [
+            '- [X] file taxes t:2025-04-15',
+            '- [X] late receipt t:2025-04-20',
+            '- [X] pay rent t:2025-04-01',
+        ]
+        assert run('done', ['--from', '2025-04-16', 'receipt'], verbose=1) == [
+            '- [X] late receipt t:2025-04-20',
+            '---',
+            'DONE: 1 of 5 tasks shown',
+        ]
+        assert run('done', ['--to', '2025-03']) == []
+        with pytest.raises(ValueError):
+            run('done', ['--from', 'april'])
+        with pytest.raises(ValueError):
+            run('done', ['--to', '2025-02-30'])
+
+    def test_parse_workspace(self, todo_file, monkeypatch):
+        todo_dir = os.path.dirname(todo_file)
+        for page, content in [
+            ('projects/house.md', '- [ ] paint fence :home: t:2022-05-02\n'),
+            ('projects/.hidden/page.md', '- [ ] hidden\n'),
+            ('done/2022-04.md', '- [X] archived\n'),
+            ('done.md', '- [X] archived\n'),
+            ('notes.txt', '- [ ] not a page\n'),
+        ]:
+            os.makedirs(os.path.join(todo_dir, os.path.dirname(page)), exist_ok=True)
+            with open(os.path.join(todo_dir, page), 'w') as fh:
+                fh.write(content)
+        exclude = [os.path.join(todo_dir, 'done.md'), os.path.join(todo_dir, 'done')]
+
+        todo = todolist.parse_workspace(todo_dir, exclude)
+        assert todo.items[-1] == (
+            '- [ ] paint fence :home: t:2022-05-02 [[projects/house]]'
+        )
+        assert todo.items[0] == "- [X] implement 'archive' command :coding: [[todo]]"
+        assert len(todo.items) == 6
+        assert todo.dates[-1] == 't:2022-05-02'
+        assert todolist.context_view(todo, ['fence']) == [
+            '# Contexts',
+            '',
+            '## home',
+            '- [ ] paint fence :home: t:2022-05-02 [[projects/house]]',
+            '',
+        ]
+
+        monkeypatch.setattr(todolist, 'WORKSPACE_POOL_MIN', 0)
+        assert todolist.parse_workspace(todo_dir, exclude, workers=2) == todo
+        assert todolist.run(
+            'ls',
+            ['--workspace', 'fence'],
+            todo_file,
+            done_file=exclude[0],
+            done_dir=exclude[1],
+        ) == ['- [ ] paint fence :home: t:2022-05-02 [[projects/house]]']
+
+    def test_daemon(self, todo_file):
+        server = todoserver.TodoServer(todo_file)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            assert todolist.query_daemon(todo_file, 'ls', ['home']) == {
+                'status': 0,
+                'output': [
+                    '- [ ] buy milk :home: t:2022-05-02 today',
+                    '- [ ] Call mom :home:',
+                ],
+                'errors': '',
+            }
+            with open(todo_file, 'a') as fh:
+                fh.write('- [ ] water plants :home:\n')
+            assert todolist.query_daemon(todo_file, 'ls', ['home', 'plants']) == {
+                'status': 0,
+                'output': ['- [ ] water plants :home:'],
+                'errors': '',
+            }
+            response = todolist.query_daemon(todo_file, 'ls', ['[x'])
+            assert response['errors'].startswith('grep: ')
+            assert todolist.query_daemon(todo_file, 'unknown', [])['status'] == 1
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        os.unlink(todolist.get_sidecar_file(todo_file, 'sock'))
+        assert todolist.query_daemon(todo_file, 'ls', []) is None
+
+    def test_import_time(self):
+        modules = imported_modules('todolist')
+        assert 'todolist' in modules
+        assert [module for module in DEFERRED_MODULES if module in modules] == []
+
+    def test_lazy_startup(self, todo_file):
+        code = '''
+import os, sys, json, todolist
+regexes = [v for v in vars(todolist).values() if isinstance(v, todolist.LazyRegex)]
+index_file = todolist.get_sidecar_file(sys.argv[1], 'idx')
+state = lambda: [sum(r.regex is None for r in regexes), os.path.exists(index_file)]
+imported = state()
+todolist.run('ls', [], sys.argv[1])
+print(json.dumps([len(regexes), imported, state()]))
+'''
+        result = subprocess.run(
+            [sys.executable, '-c', code, todo_file],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        regexes, imported, listed = json.loads(result.stdout)
+        # Nothing is compiled or written by the import, a listing only compiles some
+        assert imported == [regexes, False]
+        assert 0 < listed[0] < regexes
+        assert listed[1]
+
+    def test_task(self, todo_file):
+        tasks = todolist.load_tasks(todo_file)
+        with open(todo_file, 'rb') as fh:
+            content = fh.read()
+        assert all(task.buffer is tasks[0].buffer for task in tasks)
+        assert tasks[1].buffer == content
+        assert tasks[1].text == '- [ ] add some more info to the README :docs:'
+        assert tasks[5].contexts is tasks[6].contexts == (':home:',)
+        assert tasks[1].dates is tasks[6].dates == ()
+        assert todolist.get_subtasks(tasks, 1) == [2, 3]
+        assert todolist.get_subtasks(tasks, 2) == []
+        assert tasks[7] == todolist.Task(252, 0, None, '# Notes :notes:', [':notes:'])
+        assert repr(tasks[7]) == (
+            "Task(offset=252, indent=0, status=None, text='# Notes :notes:', "
+            "contexts=(':notes:',), dates=(), parent=None)"
+        )
+        with pytest.raises(AttributeError):
+            tasks[0].note = 'tasks have no __dict__'
+
+    def test_scan_lines(self, todo_file, monkeypatch):
+        with open(todo_file, 'rb') as fh:
+            content = fh.read()
+        monkeypatch.setattr(todolist, 'SCAN_RELEASE_SIZE', 16)
+        lines = list(todolist.scan_lines(todo_file, b':home:'))
+        assert [content[start:].split(b'\n')[0] for start, line in lines] == [
+            line for start, line in lines
+        ]
+        assert [line for start, line in lines] == [
+            line for line in content.splitlines() if b':home:' in line
+        ]
+        tasks = list(todolist.scan_tasks(todo_file))
+        assert [task.offset for task in tasks] == [
+            task.offset for task in todolist.load_tasks(todo_file) if task.status
+        ]
+        with open(todo_file, 'wb') as fh:
+            fh.write(b'- [ ] first\n- [ ] last without newline')
+        assert [line for start, line in todolist.scan_lines(todo_file, b'last')] == [
+            b'- [ ] last without newline'
+        ]
+        open(todo_file, 'w').close()
+        assert list(todolist.scan_lines(todo_file, b'- [')) == []
+
+    def test_file_lock(self, todo_file):
+        lock_file = todolist.get_sidecar_file(todo_file, 'lock')
+        code = (
+            'import sys, fcntl\n'
+            'fcntl.flock(open(sys.argv[1], "a"), fcntl.LOCK_EX | fcntl.LOCK_NB)\n'
+        )
+        try_lock = lambda: subprocess.run(
+            [sys.executable, '-c', code, lock_file], capture_output=True
+        ).returncode
+        with todolist.FileLock(todo_file):
+            with todolist.FileLock(todo_file):
+                assert try_lock() == 1
+            assert try_lock() == 1
+        assert try_lock() == 0
+
+    def test_archive_conflict(self, todo_file, monkeypatch):
+        get_signature = todolist.get_signature
+        changes = iter([False, True, False, False])
+
+        def changing_signature(path):
+            # The todo file is saved from somewhere else during the first attempt
+            if next(changes):
+                with open(todo_file, 'a') as fh:
+                    fh.write('- [ ] added while archiving\n')
+            return get_signature(path)
+
+        monkeypatch.setattr(todolist, 'get_signature', changing_signature)
+        done_file = os.path.join(os.path.dirname(todo_file), 'done.md')
+        todolist.archive(todo_file, done_file)
+        with open(done_file) as fh:
+            assert fh.read() == "- [X] implement 'archive' command :coding:\n"
+        with open(todo_file) as fh:
+            assert fh.read().endswith('- [ ] added while archiving\n')
+        assert list(changes) == []
+
+        monkeypatch.setattr(todolist, 'get_signature', lambda path: object())
+        with pytest.raises(todolist.WriteConflict):
+            todolist.archive(todo_file, done_file)
+        with open(done_file) as fh:
+            assert fh.read() == "- [X] implement 'archive' command :coding:\n"
+
+    def test_search(self, todo_file, monkeypatch):
+        todo_dir = os.path.dirname(todo_file)
+        done_file = os.path.join(todo_dir, 'done.md')
+        done_dir = os.path.join(todo_dir, 'done')
+        with open(done_file, 'w') as fh:
+            fh.write('## 2022-04-01\n- [x] buy milk and bread\n- [x] buy a bike\n')
+        search = lambda *terms: todolist.run(
+            'search', terms, todo_file, 0, done_file, done_dir
+        )
+        assert search('buy', 'mil') == [
+            '- [ ] buy milk :home: t:2022-05-02 today',
+            '- [x] buy milk and bread',
+        ]
+        # Rarer words rank first, bike and bread are rarer than buy
+        assert search('b') == [
+            '- [x] buy milk and bread',
+            '- [x] buy a bike',
+            '- [ ] buy milk :home: t:2022-05-02 today',
+        ]
+        assert search('b', '-milk') == ['- [x] buy a bike']
+        assert search('-a', '-b', '-i') == ['- [ ] Call mom :home:']
+        assert search('unknown') == []
+        assert os.path.exists(todolist.get_sidecar_file(todo_file, 'search'))
+
+        # Archiving only indexes the appended tasks
+        indexed = []
+        read_items = todosearch.read_items
+        monkeypatch.setattr(
+            todosearch,
+            'read_items',
+            lambda path, *args: indexed.append(path) or read_items(path, *args),
+        )
+        todolist.run('archive', [], todo_file, 0, done_file, done_dir)
+        assert indexed == [todo_file, done_file]
+        assert search('implement') == ["- [X] implement 'archive' command :coding:"]
+        assert search('bread', '-milk') == []
+        with open(todo_file, 'a') as fh:
+            fh.write('- [ ] implement search\n')
+        assert todolist.run(
+            'search', ['implement'], todo_file, 1, done_file, done_dir
+        ) == [
+            '- [ ] implement search',
+            "- [X] implement 'archive' command :coding:",
+            '---',
+            'SEARCH: 2 of 8 tasks shown',
+        ]
+
+        # The todo file is edited in place, an edit far from its end is not missed
+        with open(todo_file) as fh:
+            content = fh.read()
+        with open(todo_file, 'w') as fh:
+            fh.write(content + '# filler\n' * 600)
+        assert search('milk') == [
+            '- [ ] buy milk :home: t:2022-05-02 today',
+            '- [x] buy milk and bread',
+        ]
+        with open(todo_file, 'w') as fh:
+            fh.write(content.replace('buy milk', 'buy silk') + '# filler\n' * 600)
+        with open(todo_file, 'a') as fh:
+            fh.write('- [ ] water plants\n')
+        assert search('milk') == ['- [x] buy milk and bread']
+        assert search('silk') == ['- [ ] buy silk :home: t:2022-05-02 today']
+
+    def test_record_view(self, todo_file):
+        def records(action, terms, output_format='ndjson'):
+            items = todolist.stream_items(todo_file)
+            lines = todolist.record_view(
+                items, action, terms, output_format, datetime.date(2022, 5, 1)
+            )
+            if output_format == 'json':
+                return json.loads('\n'.join(lines))
+            return [json.loads(line) for line in lines]
+
+        assert records('ls', ['intro']) == [
+            {
+                'line': 3,
+                'indent': 4,
+                'parent': 2,
+                'status': ' ',
+                'text': 'add an intro :intro:',
+                'contexts': [':intro:'],
+                'due': None,
+            }
+        ]
+        assert records('ls', [], 'json') == records('ls', [])
+        assert [r['line'] for r in records('ls', ['-add'])] == [1, 5, 6, 7]
+        assert [r['line'] for r in records('context', [])] == [1, 2, 3, 6, 7]
+        assert [r['line'] for r in records('context', ['--none', 'home'])] == [1, 2, 3]
+        assert [r['line'] for r in records('future', ['--to', '2022-05'])] == [5, 6]
+        assert [r['line'] for r in records('today', [])] == [5]
+        assert [r['line'] for r in records('nodate', [], 'json')] == [1, 2, 3, 4, 7]
+        assert records('past', ['--to', '2022-04'], 'json') == []
+
+        with pytest.raises(ValueError):
+            records('ls', [], 'xml')
+        env = {**os.environ, 'TODO_FILE': todo_file}
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'todolist.py')
+        output = subprocess.run(
+            [sys.executable, script, 'ls', '--format', 'ndjson', '--workspace', 'milk'],
+            env=env,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        assert json.loads(output)['page'] == 'todo'
@@ -0,0 +1,1630 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import os
+import sys
+import json
+import locale
+import hashlib
+import datetime
+import collections
+
+TODO_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class LazyRegex:
+    """A regex that is compiled on first use, most calls only need a few patterns.
+
+    The attributes of the compiled regex are copied to the instance when they
+    are first looked up, so later calls cost no more than on the regex itself.
+    """
+
+    def __init__(self, pattern, flags=0):
+        self.args = (pattern, flags)
+        self.regex = None
+
+    def __getattr__(self, name):
+        if self.regex is None:
+            self.regex = re.compile(*self.args)
+        value = getattr(self.regex, name)
+        setattr(self, name, value)
+        return value
+
+
+# Same patterns as the `grep -o` calls of the todo script, tokens are separated by spaces only.
+CONTEXT_RE = LazyRegex(r'[^ ]*:[^ ]+')
+ITEM_RE = LazyRegex(rb'[ \t]*- ')
+CHECKBOX_RE = LazyRegex(r'[ \t]*- \[(.)\]')
+# A done top-level task, marked with X, x or ✓, and the indented lines following it.
+DONE_RE = LazyRegex(rb'- \[(\xe2\x9c\x93|[Xx])\] +.')
+SUBTASK_RE = LazyRegex(rb' +.')
+DATE_STRIP_RE = LazyRegex(r'(^t:| *t:)[0-9-]* *')
+ISO_DATE_RE = LazyRegex(r'(\d{4})-(\d{1,2})-(\d{1,2})|(\d{4})(\d{2})(\d{2})')
+DUE_DATE_RE = LazyRegex(rb'(?:^| )t:(\d{4})-(\d{2})-(\d{2})\b')
+SHARD_RE = LazyRegex(r'(\d{4}-\d{2})\.md(\.gz)?$')
+MONTH_RE = LazyRegex(r'\d{4}-\d{2}(-\d{2})?$')
+# What follows each t: in an item, overlapping like grep would find it.
+DATE_TOKEN_RE = LazyRegex(r'(?i)t:(?=(\S*))')
+# Dates grep matches literally, case-insensitively.
+PLAIN_DATE_RE = LazyRegex(r'[0-9A-Za-z_-]+')
+# Bytes scanned by scan_tasks before it releases the pages of its memory map.
+SCAN_RELEASE_SIZE = 16 * 1024 * 1024
+# Fewer pages are parsed in this process, a pool costs more to start than it saves.
+WORKSPACE_POOL_MIN = 64
+FOLD_TABLE = str.maketrans('abcdefghijklmnopqrstuvwxyz', 'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+POSIX_CLASSES = {
+    'alpha': 'a-zA-Z',
+    'digit': '0-9',
+    'alnum': '0-9a-zA-Z',
+    'upper': 'A-Z',
+    'lower': 'a-z',
+    'space': r' \t\n\r\f\v',
+    'blank': r' \t',
+    'punct': re.escape('!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'),
+    'cntrl': r'\x00-\x1f\x7f',
+    'xdigit': '0-9a-fA-F',
+}
+RELATIVE_DATES = {'yesterday': -1, 'today': 0, 'now': 0, 'tomorrow': 1}
+CONTEXT_QUERIES = ['--all', '--any', '--none']
+FORMATS = ['json', 'ndjson']
+# Invalid dates are treated like `date -d` output, 0 seconds since the epoch.
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+INFINITY = float('inf')
+DATE_OPTIONS = ['date', 'nodate', 'past', 'future', 'today', 'yesterday', 'tomorrow']
+VIEW_ACTIONS = ['list', 'ls', 'context', *DATE_OPTIONS]
+# Seconds to wait for the daemon before falling back to parsing the todo file.
+DAEMON_TIMEOUT = 2
+DESCRIPTION = """
+Listing engine for the todo script, parses the todo file once per call.
+
+usage: todolist.py ACTION [TERM...]
+
+ACTIONS:
+list | ls : List all tasks in TODO_FILE
+context   : Show todo items group by context, an item tagged :a:b: is shown under
+            both a and b. --all, --any and --none followed by contexts separated by
+            commas only show the items with all, any or none of them
+date      : Show todo items group by date
+nodate    : Show todo items group by date without date
+past      : Show todo items group by date from today to past
+future    : Show todo items group by date from today to future
+today     : Show todo items group by date only today
+yesterday : Show todo items group by date from today to yesterday
+tomorrow  : Show todo items group by date from today to tomorrow
+            the date views take --from and --to (YYYY-MM or YYYY-MM-DD) to only show
+            the dates in between
+archive   : Move all done tasks from TODO_FILE to DONE_FILE and remove blank lines,
+            with --stamp the archived tasks are put under a heading with today's date,
+            with --shard they are put into monthly shards in DONE_DIR instead
+done      : List archived tasks from DONE_FILE and the shards in DONE_DIR,
+            --from and --to (YYYY-MM or YYYY-MM-DD) only read the shards in between
+compress  : Gzip the shards in DONE_DIR before a month (YYYY-MM), a year ago by default
+search    : Search the tasks in TODO_FILE, DONE_FILE and DONE_DIR by words, the best
+            matches first. Each word of a TERM matches the words starting with it,
+            the index is kept in .todo.search next to TODO_FILE
+serve     : Keep TODO_FILE parsed in memory and answer the listing actions over the
+            socket .todo.sock next to it, they are answered by the daemon if it runs
+
+With --workspace the listing actions read every markdown page below the directory
+of TODO_FILE instead, except DONE_FILE and DONE_DIR, and tag each task with its page.
+
+With --format json or ndjson the listing actions print a JSON record of each task
+they show instead, as soon as it is read: line, indent, parent (the line of the
+task it is nested under), status, text, contexts and due. Nested tasks are
+included, in the order of the file.
+
+TERMs filter tasks like grep, prefix a TERM with '-' to hide matching tasks.
+The files are taken from TODO_FILE, DONE_FILE and DONE_DIR, verbosity from
+TODOTXT_VERBOSE. TODOTXT_ARCHIVE_SHARDS=1 makes --shard the default for archive,
+TODOTXT_WORKSPACE=1 makes --workspace the default for the listing actions.
+"""
+
+# Bump when the index format changes to invalidate existing indexes.
+INDEX_VERSION = 3
+# Appends recorded in an index file before it is rewritten as a whole.
+INDEX_APPENDS_MAX = 64
+INDEX_COLUMNS = ['offsets', 'indents', 'statuses', 'contexts', 'dates', 'parents']
+MANIFEST_VERSION = 1
+# Attempts to rewrite a file that keeps changing underneath, eg. saved by an editor.
+WRITE_ATTEMPTS = 3
+
+# item_contexts holds the context tokens of each item, in the order of items
+TodoList = collections.namedtuple(
+    'TodoList', ['prefix', 'items', 'contexts', 'dates', 'item_contexts']
+)
+# Shared tuples of context and date tokens, see intern_tokens
+TOKENS = {}
+
+
+class Task:
+    """A line of a todo file that is a list item or has context or date tokens.
+
+    The text is not kept but decoded from the content of the todo file when it
+    is used, a task only holds a reference to the content and its position in
+    it. status is the checkbox mark, '' for items without checkbox and None for
+    other lines, parent is the index of the item the task is nested under.
+    """
+
+    __slots__ = (
+        'offset',
+        'indent',
+        'status',
+        'contexts',
+        'dates',
+        'parent',
+        'buffer',
+        'start',
+    )
+
+    def __init__(
+        self, offset, indent, status, text, contexts=(), dates=(), parent=None
+    ):
+        self.offset = offset
+        self.indent = indent
+        self.status = status
+        self.contexts = intern_tokens(contexts)
+        self.dates = intern_tokens(dates)
+        self.parent = parent
+        self.buffer = text.encode('utf-8', 'surrogateescape')
+        self.start = 0
+
+    @classmethod
+    def view(cls, buffer, start, offset, indent, status, contexts, dates, parent=None):
+        """Get a task of the line at start in buffer, without copying it."""
+
+        task = cls.__new__(cls)
+        task.offset = offset
+        task.indent = indent
+        task.status = status
+        task.contexts = intern_tokens(contexts)
+        task.dates = intern_tokens(dates)
+        task.parent = parent
+        task.buffer = buffer
+        task.start = start
+        return task
+
+    @property
+    def text(self):
+        end = self.buffer.find(b'\n', self.start)
+        line = self.buffer[self.start : end if end >= 0 else None]
+        return line.decode('utf-8', 'surrogateescape')
+
+    def fields(self):
+        """Get the fields of the task except its text."""
+        return [
+            self.offset,
+            self.indent,
+            self.status,
+            self.contexts,
+            self.dates,
+            self.parent,
+        ]
+
+    def __eq__(self, other):
+        if not isinstance(other, Task):
+            return NotImplemented
+        return self.fields() == other.fields() and self.text == other.text
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (
+            f'Task(offset={self.offset!r}, indent={self.indent!r}, '
+            f'status={self.status!r}, text={self.text!r}, contexts={self.contexts!r}, '
+            f'dates={self.dates!r}, parent={self.parent!r})'
+        )
+
+
+def intern_tokens(tokens):
+    """Get a shared tuple of interned tokens, most tasks have the same few."""
+    tokens = tuple(tokens)
+    if not tokens:
+        return ()
+    shared = TOKENS.get(tokens)
+    if shared is None:
+        shared = TOKENS[tokens] = tuple(sys.intern(token) for token in tokens)
+    return shared
+
+
+def get_subtasks(tasks, index):
+    """Get the indexes of the tasks nested directly under the task at index."""
+
+    subtasks = []
+    for i in range(index + 1, len(tasks)):
+        if tasks[i].status is None:
+            continue
+        if tasks[i].indent <= tasks[index].indent:
+            break
+        if tasks[i].parent == index:
+            subtasks.append(i)
+    return subtasks
+
+
+def parse(path):
+    """Get the top-level items and context and date tokens of a todo file."""
+
+    tasks = load_tasks(path)
+    items = [task.text for task in tasks if task.text.startswith('- ')]
+    contexts = [context for task in tasks for context in task.contexts]
+    dates = [date for task in tasks for date in task.dates]
+    item_contexts = [task.contexts for task in tasks if task.text.startswith('- ')]
+
+    # Like getPrefix in the todo script, eg. "TODO" for todo.md
+    prefix = re.sub(r'\.[^.].*$', '', os.path.basename(path)).upper()
+    return TodoList(prefix, items, contexts, dates, item_contexts)
+
+
+def find_pages(root, exclude=()):
+    """Find the markdown pages below root, skipping hidden directories and exclude."""
+
+    exclude = {os.path.abspath(path) for path in exclude}
+    pages = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(
+            name
+            for name in dirnames
+            if not name.startswith('.')
+            and os.path.join(dirpath, name) not in exclude
+        )
+        pages += [
+            os.path.join(dirpath, name)
+            for name in sorted(filenames)
+            if name.endswith('.md') and os.path.join(dirpath, name) not in exclude
+        ]
+    return pages
+
+
+def parse_page(path, root):
+    """Parse a workspace page, each item is tagged with a [[link]] to its page."""
+
+    with open(path, 'rb') as fd:
+        tasks = parse_lines(fd.read())
+    link = page_link(path, root)
+    items = [f'{task.text} [[{link}]]' for task in tasks if task.text.startswith('- ')]
+    contexts = [context for task in tasks for context in task.contexts]
+    dates = [date for task in tasks for date in task.dates]
+    item_contexts = [task.contexts for task in tasks if task.text.startswith('- ')]
+    return items, contexts, dates, item_contexts
+
+
+def page_link(path, root):
+    """Get the wiki link of a workspace page, eg. projects/house for projects/house.md."""
+    return os.path.splitext(os.path.relpath(path, root))[0].replace(os.sep, '/')
+
+
+def parse_workspace(root, exclude=(), workers=None):
+    """Parse every page below root and merge them into one TodoList.
+
+    The pages are parsed across a process pool with a worker per core, a small
+    workspace or a single core parses them in this process. The page indexes
+    are not used, a wiki would be littered with them.
+    """
+
+    import concurrent.futures
+
+    root = os.path.abspath(root)
+    pages = find_pages(root, exclude)
+    workers = workers or os.cpu_count() or 1
+    if len(pages) < WORKSPACE_POOL_MIN or workers == 1:
+        results = [parse_page(page, root) for page in pages]
+    else:
+        chunksize = max(1, len(pages) // (workers * 4))
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            results = list(
+                pool.map(parse_page, pages, [root] * len(pages), chunksize=chunksize)
+            )
+
+    todo = TodoList('TODO', [], [], [], [])
+    for items, contexts, dates, item_contexts in results:
+        todo.items.extend(items)
+        todo.contexts.extend(contexts)
+        todo.dates.extend(dates)
+        todo.item_contexts.extend(item_contexts)
+    return todo
+
+
+def parse_lines(content, offset=0):
+    """Parse todo file content in a single pass into tasks.
+
+    Only list items and lines with context or date tokens are kept, offsets
+    are the byte positions of the lines counted from the given offset. The
+    tasks are views into content.
+    """
+
+    tasks = []
+    start = 0
+    for line in content.split(b'\n'):
+        is_item = ITEM_RE.match(line)
+        if is_item or b':' in line:
+            text = line.decode('utf-8', 'surrogateescape')
+            contexts = []
+            dates = []
+            for match in CONTEXT_RE.finditer(text):
+                token = match.group()
+                if token.startswith(':'):
+                    contexts.append(token)
+                elif token.startswith('t:'):
+                    dates.append(token)
+
+            if is_item or contexts or dates:
+                status = None
+                if is_item:
+                    checkbox = CHECKBOX_RE.match(text)
+                    status = checkbox.group(1) if checkbox else ''
+                indent = len(text) - len(text.lstrip(' \t'))
+                tasks.append(
+                    Task.view(
+                        content, start, offset + start, indent, status, contexts, dates
+                    )
+                )
+        start += len(line) + 1
+    return tasks
+
+
+def scan_lines(path, needle):
+    """Lazily get the offset and bytes of the lines of a file that contain needle.
+
+    The file is memory-mapped and searched for needle, only the lines found
+    are copied. The pages already scanned are released from the map, so
+    memory stays flat for any file size.
+    """
+
+    import mmap
+
+    with open(path, 'rb') as fd:
+        size = os.fstat(fd.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            released = 0
+            pos = mm.find(needle)
+            while pos >= 0:
+                start = mm.rfind(b'\n', 0, pos) + 1
+                end = mm.find(b'\n', pos)
+                if end < 0:
+                    end = size
+                yield start, mm[start:end]
+
+                if end - released >= SCAN_RELEASE_SIZE and hasattr(mm, 'madvise'):
+                    boundary = end - end % mmap.PAGESIZE
+                    mm.madvise(mmap.MADV_DONTNEED, released, boundary - released)
+                    released = boundary
+                pos = mm.find(needle, end + 1)
+
+
+def scan_tasks(path, needle=b'- ['):
+    """Lazily get the tasks of the lines of a file that contain needle, see scan_lines.
+
+    Parents are not linked.
+    """
+
+    for offset, line in scan_lines(path, needle):
+        yield from parse_lines(line, offset)
+
+
+def stream_items(path, page=None):
+    """Lazily get the line, t: dates and record of each list item of a todo file.
+
+    The file is read line by line, so the first items are available before a
+    large file was read. The records are what --format prints: lines are
+    numbered from 1 and parent is the line of the item an item is nested
+    under, text is the item without its indent, list marker and checkbox and
+    due is its first t: date.
+    """
+
+    parents = []
+    with open(path, 'rb') as fd:
+        for number, line in enumerate(fd, 1):
+            if not ITEM_RE.match(line):
+                continue
+            line = line.rstrip(b'\n').decode('utf-8', 'surrogateescape')
+            tokens = CONTEXT_RE.findall(line)
+            dates = [token[2:] for token in tokens if token.startswith('t:')]
+            indent = len(line) - len(line.lstrip(' \t'))
+            checkbox = CHECKBOX_RE.match(line)
+            while parents and parents[-1][0] >= indent:
+                parents.pop()
+            record = {
+                'line': number,
+                'indent': indent,
+                'parent': parents[-1][1] if parents else None,
+                'status': checkbox.group(1) if checkbox else '',
+                'text': line[checkbox.end() if checkbox else indent + 2 :].strip(' '),
+                'contexts': [token for token in tokens if token.startswith(':')],
+                'due': dates[0] if dates else None,
+            }
+            if page is not None:
+                record['page'] = page
+            parents.append((indent, number))
+            yield line, dates, record
+
+
+def link_parents(tasks, start=0):
+    """Set the parent of each list item to the index of the item it is nested under.
+
+    Only the tasks from start on are linked, the ones before keep their parents.
+    """
+
+    # The items still open at start are the last item before it and its parents
+    parents = []
+    last = next(
+        (i for i in range(start - 1, -1, -1) if tasks[i].status is not None), None
+    )
+    while last is not None:
+        parents.insert(0, last)
+        last = tasks[last].parent
+    for i in range(start, len(tasks)):
+        task = tasks[i]
+        if task.status is None:
+            continue
+        while parents and tasks[parents[-1]].indent >= task.indent:
+            parents.pop()
+        task.parent = parents[-1] if parents else None
+        parents.append(i)
+    return tasks
+
+
+def get_sidecar_file(path, suffix):
+    """Get the path of a hidden file next to a todo file, eg. .todo.idx for suffix idx."""
+    todo_dir, todo_name = os.path.split(os.path.abspath(path))
+    return os.path.join(todo_dir, f'.{os.path.splitext(todo_name)[0]}.{suffix}')
+
+
+def get_signature(path):
+    """Get the stat fields of a file that change whenever it is written."""
+    stat = os.stat(path)
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+
+
+class WriteConflict(Exception):
+    """A file kept changing while it was being rewritten."""
+
+
+class FileLock:
+    """Exclusive advisory lock taken by everything writing a todo file.
+
+    It is a flock on the lock file next to the todo file, which the todo script
+    takes with flock(1) as well. Readers never take it. Nested locks on the same
+    file within a process are counted instead of blocking each other.
+    """
+
+    held = collections.Counter()
+
+    def __init__(self, path):
+        self.lock_file = get_sidecar_file(path, 'lock')
+        self.fd = None
+
+    def __enter__(self):
+        if not self.held[self.lock_file]:
+            import fcntl
+
+            self.fd = open(self.lock_file, 'a')
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        self.held[self.lock_file] += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.held[self.lock_file] -= 1
+        if self.fd:
+            # Closing the file releases the lock
+            self.fd.close()
+            self.fd = None
+
+
+def load_tasks(path):
+    """Get the tasks of a todo file, using and refreshing its index.
+
+    Content appended or prepended since the index was written is parsed on its
+    own, any other change reparses the whole file. The rows of appended tasks
+    are appended to the index, everything else rewrites it.
+    """
+
+    mtime = os.stat(path).st_mtime_ns
+    with open(path, 'rb') as fd:
+        content = fd.read()
+    index_file = get_sidecar_file(path, 'idx')
+    index = read_index(index_file)
+
+    tasks = None
+    content_hash = None
+    if index is not None:
+        old_size = index['size']
+        head_size = len(content) - old_size
+
+        def old_tasks(shift=0):
+            tokens = [intern_tokens(tokens) for tokens in index['tokens']]
+            return [
+                Task.view(
+                    content,
+                    offset + shift,
+                    offset + shift,
+                    indent,
+                    status,
+                    tokens[contexts],
+                    tokens[dates],
+                    parent,
+                )
+                for offset, indent, status, contexts, dates, parent in zip(
+                    *(index[column] for column in INDEX_COLUMNS)
+                )
+            ]
+
+        if head_size == 0:
+            content_hash = hashlib.sha256(content).hexdigest()
+            if content_hash == index['hash']:
+                tasks = old_tasks()
+                if index['mtime'] != mtime:
+                    append_index(
+                        index_file, index, len(content), mtime, content_hash, []
+                    )
+                return tasks
+        elif head_size > 0:
+            prefix_hash = hashlib.sha256(content[:old_size])
+            if (old_size == 0 or content[old_size - 1 : old_size] == b'\n') and (
+                prefix_hash.hexdigest() == index['hash']
+            ):
+                # The hash of the prefix goes on to hash the whole content
+                prefix_hash.update(content[old_size:])
+                content_hash = prefix_hash.hexdigest()
+                tasks = old_tasks()
+                new_tasks = parse_lines(content[old_size:], old_size)
+                tasks = link_parents(tasks + new_tasks, len(tasks))
+                if index['appends'] < INDEX_APPENDS_MAX:
+                    append_index(
+                        index_file, index, len(content), mtime, content_hash, new_tasks
+                    )
+                    return tasks
+            elif content[head_size - 1 : head_size] == b'\n' and (
+                hashlib.sha256(content[head_size:]).hexdigest() == index['hash']
+            ):
+                # The head always ends with a newline, drop the empty last line
+                tasks = parse_lines(content[: head_size - 1]) + old_tasks(head_size)
+
+    if tasks is None:
+        tasks = parse_lines(content)
+    tasks = link_parents(tasks)
+    content_hash = content_hash or hashlib.sha256(content).hexdigest()
+    write_index(index_file, len(content), mtime, content_hash, tasks)
+    return tasks
+
+
+def read_index(index_file):
+    """Read a task index with the appends recorded in it, or None if it is missing or has an old format.
+
+    The first line holds the index as it was written, each further line the
+    rows of tasks appended to the todo file since. An append that does not
+    continue the index, eg. recorded twice by concurrent calls, is skipped.
+    """
+    try:
+        with open(index_file) as fd:
+            lines = fd.read().splitlines()
+        index = json.loads(lines[0]) if lines else {}
+        if index.get('version') != INDEX_VERSION:
+            return None
+        index['appends'] = len(lines) - 1
+        for line in lines[1:]:
+            append = json.loads(line)
+            if append['base'] != index['size']:
+                continue
+            for key in ('tokens', *INDEX_COLUMNS):
+                index[key] += append[key]
+            for key in ('size', 'mtime', 'hash'):
+                index[key] = append[key]
+    except (OSError, ValueError, KeyError):
+        return None
+    return index
+
+
+def index_rows(tasks, tokens):
+    """Get the index columns of tasks, with their token tuples numbered in tokens."""
+
+    columns = {column: [] for column in INDEX_COLUMNS}
+    for task in tasks:
+        columns['offsets'].append(task.offset)
+        columns['indents'].append(task.indent)
+        columns['statuses'].append(task.status)
+        columns['contexts'].append(tokens.setdefault(task.contexts, len(tokens)))
+        columns['dates'].append(tokens.setdefault(task.dates, len(tokens)))
+        columns['parents'].append(task.parent)
+    return columns
+
+
+def write_index(index_file, size, mtime, content_hash, tasks):
+    """Write a task index, a failure only costs reparsing next time."""
+
+    import tempfile
+
+    # One list per field and the token tuples stored once, which loads faster
+    # and with less memory than a list per task.
+    tokens = {(): 0}
+    columns = index_rows(tasks, tokens)
+    index = {
+        'version': INDEX_VERSION,
+        'size': size,
+        'mtime': mtime,
+        'hash': content_hash,
+        'tokens': list(tokens),
+        **columns,
+    }
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(index_file), prefix=f'{os.path.basename(index_file)}.'
+        )
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'w') as tmp:
+            tmp.write(json.dumps(index, separators=(',', ':')) + '\n')
+        os.replace(tmp_path, index_file)
+    except OSError:
+        os.unlink(tmp_path)
+
+
+def append_index(index_file, index, size, mtime, content_hash, tasks):
+    """Record the rows of tasks appended to the todo file at the end of its index.
+
+    The line is written with a single append, a torn line makes read_index
+    fail and the index is rebuilt.
+    """
+
+    tokens = {tuple(tokens): i for i, tokens in enumerate(index['tokens'])}
+    known = len(tokens)
+    columns = index_rows(tasks, tokens)
+    append = {
+        'base': index['size'],
+        'size': size,
+        'mtime': mtime,
+        'hash': content_hash,
+        'tokens': list(tokens)[known:],
+        **columns,
+    }
+    try:
+        with open(index_file, 'a') as fd:
+            fd.write(json.dumps(append, separators=(',', ':')) + '\n')
+    except OSError:
+        pass
+
+
+def grep_re(term):
+    """Translate a grep basic regular expression into a case-insensitive Python regex."""
+
+    pattern = []
+    i = 0
+    while i < len(term):
+        char = term[i]
+        at_start = not pattern or pattern[-1] in ('^', '(', '|')
+        if char == '\\' and i + 1 < len(term):
+            i += 1
+            char = term[i]
+            if char in '(){}|+?':
+                pattern.append(char)
+            elif char in '<>':
+                pattern.append(r'\b')
+            elif char in 'bBwWsS123456789' or not char.isalnum():
+                pattern.append(f'\\{char}')
+            else:
+                pattern.append(re.escape(char))
+        elif char == '[':
+            end = i + 1
+            negate = end < len(term) and term[end] == '^'
+            if negate:
+                end += 1
+            # A ] right after [ or [^ is a literal, not the end of the bracket
+            bracket = []
+            if end < len(term) and term[end] == ']':
+                bracket.append(r'\]')
+                end += 1
+            while end < len(term) and term[end] != ']':
+                posix_class = re.match(r'\[:(\w+):\]', term[end:])
+                if posix_class and posix_class.group(1) in POSIX_CLASSES:
+                    # Already escaped for a Python character class
+                    bracket.append(POSIX_CLASSES[posix_class.group(1)])
+                    end += len(posix_class.group())
+                    continue
+                char = term[end]
+                bracket.append(f'\\{char}' if char in '\\[^' else char)
+                end += 1
+            if end >= len(term):
+                raise re.error('Unmatched [, [^, [:, [., or [=')
+            pattern.append(f'[{"^" if negate else ""}{"".join(bracket)}]')
+            i = end
+        elif char == '^' and at_start:
+            pattern.append('^')
+        elif char == '$' and i == len(term) - 1:
+            pattern.append('$')
+        elif char == '*' and at_start:
+            pattern.append(re.escape(char))
+        elif char in '(){}|+?^$':
+            pattern.append(re.escape(char))
+        else:
+            pattern.append(char)
+        i += 1
+    return re.compile(''.join(pattern), re.IGNORECASE)
+
+
+def filter_items(items, terms):
+    """Filter items like filtercommand, hiding items that match a term starting with '-'."""
+
+    for term in terms:
+        try:
+            if term.startswith('-'):
+                regex = grep_re(term[1:])
+                items = [item for item in items if not regex.search(item)]
+            else:
+                regex = grep_re(term)
+                items = [item for item in items if regex.search(item)]
+        except re.error as e:
+            print(f'grep: {e}', file=sys.stderr)
+            return []
+    return items
+
+
+def sort_key(item):
+    """Get the key to sort an item by like `env LC_COLLATE=C sort -f -k2`."""
+    # The first field is always the leading '-', the key is the rest of the line folded to upper case.
+    return (item[1:].translate(FOLD_TABLE), item)
+
+
+def sort_items(items):
+    """Sort items like `env LC_COLLATE=C sort -f -k2`."""
+    return sorted(items, key=sort_key)
+
+
+def list_items(todo, terms, verbose=0):
+    """Get the output lines of `todo ls`, filtered by terms."""
+    return format_items(todo, sort_items(filter_items(todo.items, terms)), verbose)
+
+
+def format_items(todo, items, verbose=0):
+    """Get the output lines of sorted items, with a count of them if verbose."""
+
+    output = list(items)
+    if verbose > 0:
+        output += [
+            '---',
+            f'{todo.prefix}: {len(output)} of {len(todo.items)} tasks shown',
+        ]
+    return output
+
+
+def unique_sorted(tokens):
+    """Sort tokens like `sort -u` in the user's locale."""
+    try:
+        locale.setlocale(locale.LC_COLLATE, '')
+    except locale.Error:
+        pass
+    return sorted(set(tokens), key=locale.strxfrm)
+
+
+def split_words(tokens):
+    """Split tokens into words like an unquoted variable in a bash for loop."""
+    return [
+        word for token in tokens for word in re.split(r'[ \t\n]+', token) if word
+    ]
+
+
+def context_tags(token):
+    """Split a context token into its tags, eg. :a:b: into a and b."""
+    return [tag for tag in token.split(':') if tag]
+
+
+def context_index(item_contexts, positions=None):
+    """Get an inverted index from each lower case tag to the positions of its items.
+
+    Only the given positions are indexed, in their order, by default all of them.
+    """
+
+    index = collections.defaultdict(list)
+    # The context tokens are interned, so most items share their tuple of tokens
+    tags_of = {}
+    if positions is None:
+        positions = range(len(item_contexts))
+    for i in positions:
+        contexts = item_contexts[i]
+        if not contexts:
+            continue
+        tags = tags_of.get(contexts)
+        if tags is None:
+            tags = tags_of[contexts] = {
+                tag.lower() for token in contexts for tag in context_tags(token)
+            }
+        for tag in tags:
+            index[tag].append(i)
+    return index
+
+
+def context_queries(terms):
+    """Pop the context queries from terms as (option, lower case tags) pairs."""
+
+    queries = []
+    for name in CONTEXT_QUERIES:
+        value = pop_option(terms, name)
+        if value is None:
+            continue
+        tags = [tag.lower() for tag in re.split('[,:]', value) if tag]
+        if not tags:
+            raise ValueError(f'Option {name} requires a context')
+        queries.append((name, tags))
+    return queries
+
+
+def context_query(index, size, terms):
+    """Pop the context queries from terms and get the positions of the matching items.
+
+    --all, --any and --none take contexts separated by commas or colons, eg.
+    `--all :home:,:errands:` or `--none :work:email:`. Returns None if there
+    are no queries, otherwise the positions matching all of them.
+    """
+
+    selected = None
+    for name, tags in context_queries(terms):
+        positions = [set(index.get(tag, ())) for tag in tags]
+        if name == '--all':
+            matched = set.intersection(*positions)
+        elif name == '--any':
+            matched = set.union(*positions)
+        else:
+            matched = set(range(size)).difference(*positions)
+        selected = matched if selected is None else selected & matched
+    return selected
+
+
+def context_view(todo, terms, verbose=0):
+    """Get the output lines of `todo context`.
+
+    The items are sorted once and indexed by their tags in that order, so every
+    section is read from a single index; an item tagged :a:b: is listed under
+    both a and b. The context queries of context_query narrow the items down.
+    """
+
+    terms = list(terms)
+    positions = range(len(todo.items))
+    if any(name in terms for name in CONTEXT_QUERIES):
+        index = context_index(todo.item_contexts)
+        positions = sorted(context_query(index, len(todo.items), terms))
+    if terms:
+        matches = set(filter_items(todo.items, terms))
+        positions = [i for i in positions if todo.items[i] in matches]
+    positions = sorted(positions, key=lambda i: sort_key(todo.items[i]))
+    index = context_index(todo.item_contexts, positions)
+
+    output = ['# Contexts', '']
+    # In the order of the sorted tokens like the todo script, each tag only once
+    tags = {}
+    for token in unique_sorted(todo.contexts):
+        tags.update(dict.fromkeys(context_tags(token)))
+    for tag in tags:
+        context_list = format_items(
+            todo, [todo.items[i] for i in index.get(tag.lower(), ())], verbose
+        )
+        if context_list:
+            output += [f'## {tag}', *context_list, '']
+    return output
+
+
+def date_ordinal(date_str, today):
+    """Get the day number of a due date like `date -d` parses it, or None.
+
+    Relative dates like "tomorrow" resolve to the current time of day rather
+    than midnight, so they are half a day later than the same absolute date.
+    """
+
+    if date_str.lower() in RELATIVE_DATES:
+        return today.toordinal() + RELATIVE_DATES[date_str.lower()] + 0.5
+    match = ISO_DATE_RE.fullmatch(date_str)
+    if not match:
+        return None
+    year, month, day = (int(group) for group in match.groups() if group is not None)
+    try:
+        return datetime.date(year, month, day).toordinal()
+    except ValueError:
+        return None
+
+
+def date_check(option, today, date_str):
+    """Check if a due date is shown for a date view option, like date_check of the todo script."""
+
+    date = date_ordinal(date_str, today)
+    if date is None:
+        print(f"date: invalid date '{date_str}'", file=sys.stderr)
+        date = EPOCH_ORDINAL
+    first, last = date_range(option, today)
+    return first <= date <= last
+
+
+def date_range(option, today, terms=()):
+    """Get the first and last day number shown by a date view option, inclusive.
+
+    --from and --to options (YYYY-MM or YYYY-MM-DD) are removed from terms and
+    narrow the range down further.
+    """
+
+    today = today.toordinal()
+    from_date = date_option(terms, '--from')
+    to_date = date_option(terms, '--to', end=True)
+    if option == 'nodate':
+        # Still popped so they are not searched for as terms
+        return INFINITY, -INFINITY
+    first, last = -INFINITY, INFINITY
+    if option == 'future':
+        first = today
+    elif option == 'past':
+        last = today
+    elif option != 'date':
+        threshold = today + RELATIVE_DATES[option]
+        first, last = min(today, threshold), max(today, threshold)
+
+    if from_date is not None:
+        first = max(first, from_date.toordinal())
+    if to_date is not None:
+        # Relative dates like "tomorrow" are half a day after the date
+        last = min(last, to_date.toordinal() + 0.5)
+    return first, last
+
+
+def date_option(terms, name, end=False):
+    """Pop a date option (YYYY-MM or YYYY-MM-DD) as a date, a month is widened to its first or last day."""
+
+    value = pop_option(terms, name)
+    if value is None:
+        return None
+    try:
+        date = datetime.date.fromisoformat(value if len(value) > 7 else f'{value}-01')
+    except ValueError:
+        date = None
+    if date is None or not MONTH_RE.match(value):
+        raise ValueError(
+            f'Invalid date "{value}" for {name}, use YYYY-MM or YYYY-MM-DD'
+        )
+    if end and len(value) == 7:
+        # The day before the first of the next month
+        date = (date + datetime.timedelta(days=31)).replace(day=1)
+        date -= datetime.timedelta(days=1)
+    return date
+
+
+def group_by_date(items, date_strs):
+    """Get the items of each date string whose t:DATE they contain, like grep does.
+
+    The prefixes of every t: token of an item are looked up by the lengths of
+    the dates, so the items are scanned once instead of once per date. Dates with characters
+    grep does not match literally are still matched with their grep regex.
+    """
+
+    groups = {date_str: [] for date_str in date_strs}
+    if not date_strs:
+        return groups
+    plain = collections.defaultdict(list)
+    patterns = []
+    for date_str in date_strs:
+        if PLAIN_DATE_RE.fullmatch(date_str):
+            plain[date_str.lower()].append(date_str)
+        else:
+            patterns.append((date_str, grep_re(f't:{date_str}')))
+
+    lengths = sorted({len(date_str) for date_str in plain})
+    if plain and not patterns:
+        # Only the items containing one of the dates at all are tokenized
+        any_date = re.compile(f't:(?:{"|".join(map(re.escape, plain))})', re.I)
+        items = [item for item in items if any_date.search(item)]
+    for item in items:
+        matched = set()
+        for match in DATE_TOKEN_RE.finditer(item):
+            token = match.group(1).lower()
+            for length in lengths:
+                matched.update(plain.get(token[:length], ()))
+        for date_str in matched:
+            groups[date_str].append(item)
+        for date_str, regex in patterns:
+            if regex.search(item):
+                groups[date_str].append(item)
+    return groups
+
+
+def date_view(todo, option, terms, verbose=0, today=None):
+    """Get the output lines of the date views, eg. `todo past`.
+
+    The due dates are converted to day numbers once and the ones in the range
+    of the option are found by bisecting them in date order. The items are
+    then grouped by date in a single pass.
+    """
+
+    import bisect
+
+    today = today or datetime.date.today()
+    terms = list(terms)
+    first, last = date_range(option, today, terms)
+    date_strs = split_words(token[2:] for token in unique_sorted(todo.dates))
+    ordinals = []
+    for date_str in date_strs:
+        date = date_ordinal(date_str, today)
+        if date is None:
+            print(f"date: invalid date '{date_str}'", file=sys.stderr)
+            date = EPOCH_ORDINAL
+        ordinals.append(date)
+
+    by_date = sorted(range(len(date_strs)), key=ordinals.__getitem__)
+    sorted_ordinals = [ordinals[i] for i in by_date]
+    start = bisect.bisect_left(sorted_ordinals, first)
+    end = bisect.bisect_right(sorted_ordinals, last)
+    # Back to the order of the date strings
+    shown = [date_strs[i] for i in sorted(by_date[start:end])]
+
+    items = filter_items(todo.items, terms)
+    groups = group_by_date(items, shown)
+    output = ['# Dates', '']
+    for date_str in shown:
+        date_list = [
+            DATE_STRIP_RE.sub(' ', line)
+            for line in format_items(todo, sort_items(groups[date_str]), verbose)
+        ]
+        if date_list:
+            output += [f'## {date_str}', *date_list, '']
+
+    # Show todo items not associated to a date
+    if option == 'nodate':
+        date_list = [
+            line
+            for line in format_items(todo, sort_items(items), verbose)
+            if 't:' not in line
+        ]
+        if date_list:
+            output += ['## Items without date', *date_list]
+    return output
+
+
+def record_view(items, option, terms, output_format, today=None):
+    """Get the output lines of a listing action with --format, lazily.
+
+    Instead of the markdown of the view, the records of the items from
+    stream_items it shows are printed as JSON as soon as their line is read:
+    one per line for ndjson, or as an array for json. Unlike the markdown
+    views, nested items are included, in the order of the file, and a date
+    view selects the items by their own t: dates.
+    """
+
+    terms = list(terms)
+    today = today or datetime.date.today()
+    if output_format not in FORMATS:
+        raise ValueError(f'Invalid format "{output_format}", use json or ndjson')
+    queries = context_queries(terms) if option == 'context' else []
+    if option in DATE_OPTIONS:
+        first, last = date_range(option, today, terms)
+    try:
+        regexes = [
+            (term.startswith('-'), grep_re(term[1:] if term.startswith('-') else term))
+            for term in terms
+        ]
+    except re.error as e:
+        print(f'grep: {e}', file=sys.stderr)
+        regexes = None
+
+    def shown(line, dates, record):
+        if any(bool(regex.search(line)) == hide for hide, regex in regexes):
+            return False
+        if option == 'context':
+            tags = {
+                tag.lower()
+                for token in record['contexts']
+                for tag in context_tags(token)
+            }
+            return bool(tags) and all(
+                tags.issuperset(query)
+                if name == '--all'
+                else tags.isdisjoint(query) == (name == '--none')
+                for name, query in queries
+            )
+        if option == 'nodate':
+            return not dates
+        if option in DATE_OPTIONS:
+            for date_str in dates:
+                date = date_ordinal(date_str, today)
+                if first <= (EPOCH_ORDINAL if date is None else date) <= last:
+                    return True
+            return False
+        return True
+
+    def lines():
+        if regexes is None:
+            return
+        records = (
+            record for line, dates, record in items if shown(line, dates, record)
+        )
+        encode = json.JSONEncoder(ensure_ascii=False).encode
+        if output_format == 'ndjson':
+            for record in records:
+                yield encode(record)
+            return
+        # Each record is written once the next one is known, to end it with a comma or not
+        previous = None
+        yield '['
+        for record in records:
+            if previous is not None:
+                yield f'  {encode(previous)},'
+            previous = record
+        if previous is not None:
+            yield f'  {encode(previous)}'
+        yield ']'
+
+    return lines()
+
+
+def archive(todo_file, done_file, stamp=False, done_dir=None, keep=True):
+    """Move done tasks with their subtasks from the todo file to the done file.
+
+    The todo file is streamed once, blank lines are dropped and a backup of the
+    original is kept as .bak like `sed -i.bak` does. The done file is appended
+    to before the todo file is atomically replaced, so an interrupted archive
+    can only duplicate tasks, never lose them. With done_dir the tasks go to
+    monthly shards instead of the done file. Returns the archived lines, or an
+    empty list without keep, so archiving takes the same memory however many
+    tasks are archived.
+
+    Other writers are kept out by the lock of the todo file. When it is still
+    changed while streaming it, eg. saved from an editor, the archive starts
+    over, up to WRITE_ATTEMPTS times before raising WriteConflict.
+    """
+
+    with FileLock(todo_file):
+        for attempt in range(WRITE_ATTEMPTS):
+            archived = archive_once(todo_file, done_file, stamp, done_dir, keep)
+            if archived is not None:
+                return archived
+    raise WriteConflict(f'TODO: {todo_file} kept changing while archiving it.')
+
+
+def archive_once(todo_file, done_file, stamp, done_dir, keep=True):
+    """Archive the todo file, or get None without writing if it changed meanwhile."""
+
+    import shutil
+    import tempfile
+
+    todo_dir = os.path.dirname(os.path.abspath(todo_file))
+    signature = get_signature(todo_file)
+    todo_tmp = tempfile.NamedTemporaryFile(
+        'wb', dir=todo_dir, prefix='.todo.', delete=False
+    )
+    backup_tmp = tempfile.NamedTemporaryFile(
+        'wb', dir=todo_dir, prefix='.todo.', delete=False
+    )
+    done_tmp = tempfile.TemporaryFile('w+b', dir=todo_dir)
+    try:
+        with open(todo_file, 'rb') as fd, todo_tmp, backup_tmp, done_tmp:
+            is_done_block = False
+            for line in fd:
+                backup_tmp.write(line)
+                line = line.rstrip(b'\n')
+                if not line:
+                    continue
+                if DONE_RE.match(line):
+                    is_done_block = True
+                elif not SUBTASK_RE.match(line):
+                    is_done_block = False
+                (done_tmp if is_done_block else todo_tmp).write(line + b'\n')
+
+            for tmp in (todo_tmp, backup_tmp):
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            if get_signature(todo_file) != signature:
+                return None
+
+            archived = []
+            if done_tmp.tell():
+                if keep:
+                    done_tmp.seek(0)
+                    archived = [
+                        line.rstrip(b'\n').decode('utf-8', 'surrogateescape')
+                        for line in done_tmp
+                    ]
+                done_tmp.seek(0)
+                if done_dir:
+                    write_shards(done_tmp, done_dir, stamp)
+                else:
+                    with open(done_file, 'ab') as done_fd:
+                        if stamp:
+                            done_fd.write(f'## {datetime.date.today():%F}\n'.encode())
+                        shutil.copyfileobj(done_tmp, done_fd)
+                        done_fd.flush()
+                        os.fsync(done_fd.fileno())
+
+        shutil.copymode(todo_file, todo_tmp.name)
+        shutil.copymode(todo_file, backup_tmp.name)
+        os.replace(backup_tmp.name, f'{todo_file}.bak')
+        os.replace(todo_tmp.name, todo_file)
+    finally:
+        for tmp in (todo_tmp, backup_tmp):
+            if os.path.exists(tmp.name):
+                os.unlink(tmp.name)
+    return archived
+
+
+def task_date(line, today):
+    """Get the t: date of a task line in bytes, or today if it has no valid one."""
+    match = DUE_DATE_RE.search(line)
+    if match:
+        try:
+            return datetime.date(*map(int, match.groups()))
+        except ValueError:
+            pass
+    return today
+
+
+def get_shard_file(done_dir, month):
+    """Get the path of the shard of a month, compressed if it has been gzipped."""
+    path = os.path.join(done_dir, f'{month}.md')
+    if os.path.isfile(f'{path}.gz'):
+        return f'{path}.gz'
+    return path
+
+
+def write_shards(lines, done_dir, stamp=False, today=None):
+    """Append archived task blocks to the monthly shards in done_dir.
+
+    A task and its subtasks go into the shard of the month of its t: date, tasks
+    without a date into the shard of the current month. A gzipped shard gets the
+    tasks as a new gzip member, which reads like one stream. The shards are
+    written before the manifest, so the manifest can only lag behind them.
+    """
+
+    import gzip
+
+    today = today or datetime.date.today()
+    os.makedirs(done_dir, exist_ok=True)
+    # The open shards and the first date, last date and task count per month,
+    # the lines are streamed into the shard of their month as they are read
+    shards = {}
+    ranges = {}
+    try:
+        month = None
+        for line in lines:
+            if DONE_RE.match(line):
+                date = task_date(line, today)
+                month = f'{date:%Y-%m}'
+                first, last, count = ranges.get(month, (date, date, 0))
+                ranges[month] = (min(first, date), max(last, date), count + 1)
+            shard = shards.get(month)
+            if shard is None:
+                path = get_shard_file(done_dir, month)
+                raw = fd = open(path, 'ab')
+                if path.endswith('.gz'):
+                    fd = gzip.GzipFile(fileobj=raw, mode='wb')
+                shard = shards[month] = (path, raw, fd)
+                if stamp:
+                    fd.write(f'## {today:%F}\n'.encode())
+            shard[2].write(line)
+        for path, raw, fd in shards.values():
+            if fd is not raw:
+                fd.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+    finally:
+        for path, raw, fd in shards.values():
+            raw.close()
+
+    manifest = read_manifest(done_dir)
+    for month, (first, last, count) in sorted(ranges.items()):
+        first, last = f'{first:%F}', f'{last:%F}'
+        shard = manifest.get(month)
+        if shard:
+            first, last = min(first, shard['first']), max(last, shard['last'])
+            count += shard['count']
+        manifest[month] = {
+            'file': os.path.basename(shards[month][0]),
+            'first': first,
+            'last': last,
+            'count': count,
+        }
+    write_manifest(done_dir, manifest)
+
+
+def read_manifest(done_dir):
+    """Read the shards of the manifest in done_dir, empty if it is missing."""
+    try:
+        with open(os.path.join(done_dir, 'manifest.json')) as fd:
+            manifest = json.load(fd)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest['shards']
+
+
+def write_manifest(done_dir, shards):
+    """Atomically write the date ranges and task counts of the shards."""
+
+    import tempfile
+
+    manifest = {'version': MANIFEST_VERSION, 'shards': dict(sorted(shards.items()))}
+    fd, tmp_path = tempfile.mkstemp(dir=done_dir, prefix='.manifest.')
+    try:
+        with os.fdopen(fd, 'w') as tmp:
+            json.dump(manifest, tmp, indent=2)
+            tmp.write('\n')
+        os.replace(tmp_path, os.path.join(done_dir, 'manifest.json'))
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def get_shards(done_dir, from_date=None, to_date=None):
+    """Get the month and path of the shards overlapping a date range, oldest first.
+
+    The ranges are taken from the manifest, a shard missing from it is assumed
+    to span its whole month. A plain shard next to a gzipped one is a leftover
+    of an interrupted compress and is skipped.
+    """
+
+    if not os.path.isdir(done_dir):
+        return []
+    manifest = read_manifest(done_dir)
+    shards = {}
+    for name in sorted(os.listdir(done_dir)):
+        match = SHARD_RE.match(name)
+        if not match:
+            continue
+        month = match[1]
+        shard = manifest.get(month, {'first': f'{month}-01', 'last': f'{month}-31'})
+        if from_date and shard['last'] < from_date:
+            continue
+        if to_date and shard['first'] > to_date:
+            continue
+        shards[month] = get_shard_file(done_dir, month)
+    return sorted(shards.items())
+
+
+def read_shard(path):
+    """Lazily get the lines of a shard, gzipped or not."""
+
+    import gzip
+
+    with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as fd:
+        for line in fd:
+            yield line.rstrip(b'\n').decode('utf-8', 'surrogateescape')
+
+
+def compress_shards(done_dir, before):
+    """Gzip the plain shards of the months before `before` (YYYY-MM).
+
+    The compressed shard replaces the plain one atomically, the plain one is
+    removed afterwards. Returns the names of the compressed shards.
+    """
+
+    import gzip
+    import shutil
+    import tempfile
+
+    manifest = read_manifest(done_dir)
+    compressed = []
+    for month, path in get_shards(done_dir):
+        if month >= before:
+            continue
+        plain = os.path.join(done_dir, f'{month}.md')
+        if path.endswith('.gz'):
+            if os.path.isfile(plain):
+                os.unlink(plain)
+            continue
+        fd, tmp_path = tempfile.mkstemp(dir=done_dir, prefix=f'.{month}.')
+        try:
+            with os.fdopen(fd, 'wb') as raw, open(path, 'rb') as src:
+                with gzip.GzipFile(filename='', fileobj=raw, mode='wb', mtime=0) as gz:
+                    shutil.copyfileobj(src, gz)
+                raw.flush()
+                os.fsync(raw.fileno())
+            shutil.copymode(path, tmp_path)
+            os.replace(tmp_path, f'{path}.gz')
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        os.unlink(path)
+        if month in manifest:
+            manifest[month]['file'] = f'{month}.md.gz'
+        compressed.append(f'{month}.md')
+    if compressed and manifest:
+        write_manifest(done_dir, manifest)
+    return compressed
+
+
+def done_items(done_file, done_dir, terms, verbose=0, from_date=None, to_date=None):
+    """List the archived top-level tasks like list_items.
+
+    Without a date range the done file is read as well, with one only the
+    shards overlapping the range are read.
+    """
+
+    paths = [path for month, path in get_shards(done_dir, from_date, to_date)]
+    if not from_date and not to_date and done_file and os.path.isfile(done_file):
+        paths.insert(0, done_file)
+    items = [line for path in paths for line in read_shard(path) if line[:2] == '- ']
+    return list_items(TodoList('DONE', items, [], [], []), terms, verbose)
+
+
+def pop_option(terms, name):
+    """Remove an option and its value from the terms and return the value."""
+    if name not in terms:
+        return None
+    i = terms.index(name)
+    if i + 1 == len(terms):
+        raise ValueError(f'Option {name} requires a value')
+    value = terms[i + 1]
+    del terms[i : i + 2]
+    return value
+
+
+def run(
+    action,
+    terms,
+    todo_file,
+    verbose=0,
+    done_file=None,
+    done_dir=None,
+    shard=False,
+    workspace=False,
+):
+    """Run an action on the todo file and return the output lines."""
+
+    if action == 'archive':
+        shard = shard or '--shard' in terms
+        archived = archive(
+            todo_file,
+            done_file,
+            '--stamp' in terms,
+            done_dir if shard else None,
+            keep=verbose > 0,
+        )
+        if os.path.exists(get_sidecar_file(todo_file, 'search')):
+            import todosearch
+
+            # Index the archived tasks now rather than on the next search
+            todosearch.refresh_index(todo_file, done_file, done_dir)
+        if verbose > 0:
+            return [*archived, f'TODO: {todo_file} archived.']
+        return []
+    if action == 'done':
+        terms = list(terms)
+        from_date = date_option(terms, '--from')
+        to_date = date_option(terms, '--to', end=True)
+        # The shards and the manifest compare dates as YYYY-MM-DD strings
+        from_date = from_date and f'{from_date:%F}'
+        to_date = to_date and f'{to_date:%F}'
+        return done_items(done_file, done_dir, terms, verbose, from_date, to_date)
+    if action == 'search':
+        import todosearch
+
+        return todosearch.search(todo_file, done_file, done_dir, terms, verbose)
+    if action == 'compress':
+        if terms:
+            if not MONTH_RE.match(terms[0]) or len(terms[0]) != 7:
+                raise ValueError(f'Invalid month "{terms[0]}", use YYYY-MM')
+            before = terms[0]
+        else:
+            today = datetime.date.today()
+            before = f'{today.year - 1}-{today.month:02d}'
+        with FileLock(todo_file):
+            compressed = compress_shards(done_dir, before)
+        if verbose > 0:
+            return [f'DONE: {name} compressed.' for name in compressed]
+        return []
+
+    terms = list(terms)
+    if '--workspace' in terms:
+        terms.remove('--workspace')
+        workspace = True
+    root = os.path.dirname(os.path.abspath(todo_file))
+    exclude = [path for path in (done_file, done_dir) if path]
+    output_format = pop_option(terms, '--format') if action in VIEW_ACTIONS else None
+    if output_format is not None:
+        if workspace:
+            items = (
+                item
+                for page in find_pages(root, exclude)
+                for item in stream_items(page, page_link(page, root))
+            )
+        else:
+            items = stream_items(todo_file)
+        return record_view(items, action, terms, output_format)
+    if workspace:
+        todo = parse_workspace(root, exclude)
+    else:
+        todo = parse(todo_file)
+    return view(todo, action, terms, verbose)
+
+
+def view(todo, action, terms, verbose=0):
+    """Get the output lines of a listing action."""
+
+    if action in ('list', 'ls'):
+        return list_items(todo, terms, verbose)
+    if action == 'context':
+        return context_view(todo, terms, verbose)
+    if action in DATE_OPTIONS:
+        return date_view(todo, action, terms, verbose)
+    raise ValueError(f'Unknown action "{action}"')
+
+
+def query_daemon(todo_file, action, terms, verbose=0):
+    """Get the response of the daemon of a todo file, or None if it does not run."""
+
+    socket_file = get_sidecar_file(todo_file, 'sock')
+    if not os.path.exists(socket_file):
+        return None
+
+    import socket
+
+    request = {'action': action, 'terms': list(terms), 'verbose': verbose}
+    try:
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.settimeout(DAEMON_TIMEOUT)
+            sock.connect(socket_file)
+            sock.sendall(json.dumps(request).encode() + b'\n')
+            with sock.makefile('rb') as fd:
+                return json.loads(fd.readline())
+    except (OSError, ValueError):
+        return None
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] in ('-h', '--help', 'help'):
+        print(DESCRIPTION.strip())
+        return 0
+
+    action = argv[1].lower()
+    todo_file = os.environ.get('TODO_FILE', os.path.join(TODO_DIR, 'todo.md'))
+    done_file = os.environ.get('DONE_FILE', os.path.join(TODO_DIR, 'done.md'))
+    done_dir = os.environ.get('DONE_DIR', os.path.join(TODO_DIR, 'done'))
+    shard = os.environ.get('TODOTXT_ARCHIVE_SHARDS') == '1'
+    workspace = os.environ.get('TODOTXT_WORKSPACE') == '1'
+    verbose = int(os.environ.get('TODOTXT_VERBOSE') or 0)
+    if not os.path.isfile(todo_file):
+        print(f'TODO: File {todo_file} does not exist.')
+        return 1
+
+    if action == 'serve':
+        import todoserver
+
+        return todoserver.serve(todo_file)
+    if (
+        action in VIEW_ACTIONS
+        and not workspace
+        and '--workspace' not in argv
+        and '--format' not in argv
+    ):
+        response = query_daemon(todo_file, action, argv[2:], verbose)
+        if response is not None:
+            sys.stderr.write(response['errors'])
+            output = response['output']
+            if output:
+                sys.stdout.buffer.write(
+                    '\n'.join(output).encode('utf-8', 'surrogateescape') + b'\n'
+                )
+            return response['status']
+
+    try:
+        output = run(
+            action, argv[2:], todo_file, verbose, done_file, done_dir, shard, workspace
+        )
+    except (ValueError, WriteConflict) as e:
+        print(e, file=sys.stderr)
+        return 1
+    if isinstance(output, list):
+        if output:
+            sys.stdout.buffer.write(
+                '\n'.join(output).encode('utf-8', 'surrogateescape') + b'\n'
+            )
+    else:
+        # The lines of --format are written as they are produced
+        try:
+            for line in output:
+                sys.stdout.buffer.write(
+                    line.encode('utf-8', 'surrogateescape') + b'\n'
+                )
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # The reader stopped early, eg. `| head`, the rest is not wanted
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Full-text search over the todo file and the archive, `todolist.py search`.
+
+The words of the tasks are indexed in the SQLite database .todo.search next to
+the todo file, which answers a query without loading the whole index. When a file
+was only appended to, just the new tasks are indexed.
+"""
+
+import os
+import math
+import sqlite3
+import hashlib
+import contextlib
+import collections
+
+import todolist
+
+# Bump when the search index format changes to rebuild existing indexes.
+SEARCH_VERSION = 1
+# Bytes at the end of the indexed part of an archive file that have to be
+# unchanged to only index what was appended to it.
+TAIL_SIZE = 4096
+# Words a term matches exactly count more than the ones it is a prefix of.
+EXACT_WEIGHT = 2
+# Seconds to wait for another process updating the index.
+SEARCH_TIMEOUT = 10
+WORD_RE = todolist.LazyRegex(r'\w+')
+SCHEMA = """
+CREATE TABLE sources (
+    id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime INTEGER, tail TEXT
+);
+CREATE TABLE items (
+    source INTEGER, offset INTEGER, PRIMARY KEY (source, offset)
+) WITHOUT ROWID;
+CREATE TABLE words (
+    word TEXT, source INTEGER, offset INTEGER, PRIMARY KEY (word, source, offset)
+) WITHOUT ROWID;
+"""
+
+
+def get_sources(todo_file, done_file, done_dir):
+    """Get the files to search, the todo file first and the newest shard last."""
+
+    sources = [todo_file]
+    if done_file and os.path.isfile(done_file):
+        sources.append(done_file)
+    if done_dir:
+        sources += [path for month, path in todolist.get_shards(done_dir)]
+    return [os.path.abspath(path) for path in sources]
+
+
+def read_items(path, start=0, end=None):
+    """Lazily get the offset and text of the tasks in a file between two offsets.
+
+    The offsets of gzipped shards count the uncompressed bytes.
+    """
+
+    import gzip
+
+    with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as fd:
+        fd.seek(start)
+        offset = start
+        for line in fd:
+            if end is not None and offset >= end:
+                break
+            if line.startswith(b'- '):
+                yield offset, line.rstrip(b'\n').decode('utf-8', 'surrogateescape')
+            offset += len(line)
+
+
+def read_lines(path, offsets):
+    """Get the text of the tasks at the given offsets of a file."""
+
+    if path.endswith('.gz'):
+        # Seeking in a gzipped file decompresses everything before anyway
+        return {offset: text for offset, text in read_items(path) if offset in offsets}
+    lines = {}
+    with open(path, 'rb') as fd:
+        for offset in sorted(offsets):
+            fd.seek(offset)
+            lines[offset] = fd.readline().rstrip(b'\n').decode(
+                'utf-8', 'surrogateescape'
+            )
+    return lines
+
+
+def file_tail(path, size, tail_size=TAIL_SIZE):
+    """Get the hash of the last tail_size bytes before size in a file, all of them with None."""
+
+    if tail_size is None or tail_size > size:
+        tail_size = size
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fd:
+        fd.seek(size - tail_size)
+        while tail_size > 0:
+            block = fd.read(min(tail_size, 2**20))
+            if not block:
+                break
+            digest.update(block)
+            tail_size -= len(block)
+    return digest.hexdigest()
+
+
+def connect(search_file):
+    """Open the search index, creating it or starting over if its version is old."""
+
+    db = sqlite3.connect(search_file, timeout=SEARCH_TIMEOUT)
+    if db.execute('PRAGMA user_version').fetchone()[0] != SEARCH_VERSION:
+        with db:
+            tables = db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            for (table,) in tables.fetchall():
+                db.execute(f'DROP TABLE {table}')
+            db.executescript(SCHEMA)
+            db.execute(f'PRAGMA user_version = {SEARCH_VERSION}')
+    return db
+
+
+def index_source(db, path, append_only=True):
+    """Bring the index of a file up to date and get its source id.
+
+    An unchanged file keeps its index. If a plain file only grew and its
+    indexed part is unchanged, only the appended tasks are indexed, like after
+    archiving to it. Otherwise the whole file is indexed again. The archive is
+    only ever appended to, so only the end of its indexed part is compared; the
+    todo file is edited in place, without append_only all of it is compared.
+    """
+
+    tail_size = TAIL_SIZE if append_only else None
+
+    stat = os.stat(path)
+    row = db.execute(
+        'SELECT id, size, mtime, tail FROM sources WHERE path = ?', (path,)
+    ).fetchone()
+    if row and row[1:3] == (stat.st_size, stat.st_mtime_ns):
+        return row[0]
+
+    plain = not path.endswith('.gz')
+    start = 0
+    with db:
+        if row is None:
+            source = db.execute('INSERT INTO sources (path) VALUES (?)', (path,))
+            source = source.lastrowid
+        else:
+            source, size, mtime, tail = row
+            if plain and stat.st_size > size and file_tail(path, size, tail_size) == tail:
+                start = size
+            else:
+                db.execute('DELETE FROM items WHERE source = ?', (source,))
+                db.execute('DELETE FROM words WHERE source = ?', (source,))
+
+        items = []
+        words = []
+        for offset, text in read_items(path, start, stat.st_size if plain else None):
+            items.append((source, offset))
+            words += [
+                (word, source, offset) for word in set(WORD_RE.findall(text.lower()))
+            ]
+        db.executemany('INSERT INTO items VALUES (?, ?)', items)
+        db.executemany('INSERT INTO words VALUES (?, ?, ?)', words)
+        db.execute(
+            'UPDATE sources SET size = ?, mtime = ?, tail = ? WHERE id = ?',
+            (
+                stat.st_size,
+                stat.st_mtime_ns,
+                file_tail(path, stat.st_size, tail_size) if plain else None,
+                source,
+            ),
+        )
+    return source
+
+
+def update_index(db, todo_file, done_file=None, done_dir=None):
+    """Index the todo file and the archive and get the path of each source id.
+
+    The sources are in the order of get_sources, files that are gone, like
+    shards replaced by their gzipped version, are dropped from the index.
+    """
+
+    todo_file = os.path.abspath(todo_file)
+    paths = {
+        index_source(db, path, append_only=path != todo_file): path
+        for path in get_sources(todo_file, done_file, done_dir)
+    }
+    gone = [
+        (source,)
+        for (source,) in db.execute('SELECT id FROM sources').fetchall()
+        if source not in paths
+    ]
+    if gone:
+        with db:
+            db.executemany('DELETE FROM items WHERE source = ?', gone)
+            db.executemany('DELETE FROM words WHERE source = ?', gone)
+            db.executemany('DELETE FROM sources WHERE id = ?', gone)
+    return paths
+
+
+def refresh_index(todo_file, done_file=None, done_dir=None):
+    """Bring the search index up to date, eg. right after archiving."""
+    search_file = todolist.get_sidecar_file(todo_file, 'search')
+    with contextlib.closing(connect(search_file)) as db:
+        update_index(db, todo_file, done_file, done_dir)
+
+
+def match_term(db, term_words, idf):
+    """Get the score of each task with a word starting with each word of a term.
+
+    Tasks are (source, offset) pairs. The words of a prefix are a range of the
+    primary key of the words table, so only the matching rows are read.
+    """
+
+    scores = None
+    for term_word in term_words:
+        rows = db.execute(
+            'SELECT word, source, offset FROM words WHERE word >= ? AND word < ?',
+            (term_word, f'{term_word}\U0010ffff'),
+        ).fetchall()
+        frequencies = collections.Counter(word for word, source, offset in rows)
+        best = {}
+        for word, source, offset in rows:
+            weight = idf(frequencies[word]) * (EXACT_WEIGHT if word == term_word else 1)
+            if best.get((source, offset), 0) < weight:
+                best[source, offset] = weight
+        if scores is None:
+            scores = best
+        else:
+            scores = {
+                task: score + best[task] for task, score in scores.items() if task in best
+            }
+    return scores
+
+
+def search(todo_file, done_file, done_dir, terms, verbose=0):
+    """Get the output lines of `todo search`, the best matching tasks first.
+
+    Like the TERMs of `todo ls`, every term has to match and a term starting
+    with '-' hides the tasks it matches. A term matches the tasks with a word
+    starting with each of its words. Rarer words and whole words rank higher,
+    ties keep the order of the files.
+    """
+
+    include = []
+    exclude = []
+    for term in terms:
+        term_words = WORD_RE.findall(term.lower())
+        if term_words:
+            (exclude if term.startswith('-') else include).append(term_words)
+
+    search_file = todolist.get_sidecar_file(todo_file, 'search')
+    with contextlib.closing(connect(search_file)) as db:
+        paths = update_index(db, todo_file, done_file, done_dir)
+        total = db.execute('SELECT count(*) FROM items').fetchone()[0]
+        idf = lambda frequency: math.log(1 + total / frequency)
+
+        if include:
+            scores = match_term(db, include[0], idf)
+            for term_words in include[1:]:
+                matched = match_term(db, term_words, idf)
+                scores = {
+                    task: score + matched[task]
+                    for task, score in scores.items()
+                    if task in matched
+                }
+        else:
+            scores = dict.fromkeys(db.execute('SELECT source, offset FROM items'), 0)
+        for term_words in exclude:
+            for task in match_term(db, term_words, idf):
+                scores.pop(task, None)
+
+    rank = {source: i for i, source in enumerate(paths)}
+    results = sorted(scores, key=lambda task: (-scores[task], rank[task[0]], task[1]))
+    offsets = collections.defaultdict(set)
+    for source, offset in results:
+        offsets[source].add(offset)
+    texts = {
+        source: read_lines(paths[source], source_offsets)
+        for source, source_offsets in offsets.items()
+    }
+    output = [texts[source][offset] for source, offset in results]
+    if verbose > 0:
+        output += ['---', f'SEARCH: {len(output)} of {total} tasks shown']
+    return output
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Daemon of the listing engine, started with `todolist.py serve`.
+
+It lives in its own module so the listing actions do not pay for importing
+the socket server.
+"""
+
+import io
+import os
+import sys
+import json
+import signal
+import socket
+import datetime
+import contextlib
+import socketserver
+
+import todolist
+
+# Cached query results of the daemon, dropped when the todo file changes.
+DAEMON_CACHE_SIZE = 1000
+
+
+class TodoServer(socketserver.UnixStreamServer):
+    """Answer listing actions from a todo file kept parsed in memory.
+
+    The todo file is stat'ed before every query and reloaded with load_tasks
+    when it changed, which only parses the lines added to its top or bottom.
+    Results are cached until the file or the date changes.
+    """
+
+    def __init__(self, todo_file):
+        self.todo_file = todo_file
+        self.signature = None
+        self.todo = None
+        self.results = {}
+        super().__init__(todolist.get_sidecar_file(todo_file, 'sock'), TodoHandler)
+
+    def refresh(self):
+        signature = todolist.get_signature(self.todo_file)
+        if signature != self.signature:
+            self.todo = todolist.parse(self.todo_file)
+            self.signature = signature
+            self.results.clear()
+
+    def query(self, action, terms, verbose=0):
+        """Get the encoded response line to a listing action."""
+
+        self.refresh()
+        key = (action, tuple(terms), verbose, datetime.date.today())
+        if key not in self.results:
+            if len(self.results) >= DAEMON_CACHE_SIZE:
+                self.results.clear()
+            errors = io.StringIO()
+            with contextlib.redirect_stderr(errors):
+                output = todolist.view(self.todo, action, list(terms), verbose)
+            response = {'status': 0, 'output': output, 'errors': errors.getvalue()}
+            self.results[key] = json.dumps(response).encode() + b'\n'
+        return self.results[key]
+
+
+class TodoHandler(socketserver.StreamRequestHandler):
+    """Handle a query of one JSON line with action, terms and verbose.
+
+    The response is a JSON line with the exit status, the output lines and the
+    error messages of the action.
+    """
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # A connection check of `serve`
+            return
+        try:
+            request = json.loads(line)
+            response = self.server.query(
+                request['action'], request.get('terms', []), request.get('verbose', 0)
+            )
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            response = {'status': 1, 'output': [], 'errors': f'{e}\n'}
+            response = json.dumps(response).encode() + b'\n'
+        try:
+            self.wfile.write(response)
+        except BrokenPipeError:
+            pass
+
+
+def serve(todo_file):
+    """Run the daemon of a todo file until it is terminated."""
+
+    socket_file = todolist.get_sidecar_file(todo_file, 'sock')
+    if os.path.exists(socket_file):
+        with socket.socket(socket.AF_UNIX) as sock:
+            try:
+                sock.connect(socket_file)
+            except OSError:
+                # Left behind by a daemon that was killed
+                os.unlink(socket_file)
+            else:
+                print(f'TODO: Daemon already listening on {socket_file}')
+                return 1
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server = TodoServer(todo_file)
+    try:
+        server.refresh()
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_file)
+    return 0